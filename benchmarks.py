@@ -0,0 +1,389 @@
+#! /usr/bin/env python
+""" Benchmarks for docker-systemctl-replacement internals """
+
+from __future__ import print_function
+
+__copyright__ = "(C) Guido Draheim, licensed under the EUPL"""
+__version__ = "1.4.4147"
+
+## NOTE:
+## The benchmarks are run in-process on a synthetic tree in a temp folder,
+## results are printed as a table (and can be saved with --output).
+## The graph benchmarks run on --root trees of each of the --sizes, the
+## trees are generated from a --seed so that the runs are repeatable.
+
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import tempfile
+import logging
+
+logg = logging.getLogger("BENCH")
+_systemctl_py = "files/docker/systemctl.py"
+
+def load_systemctl(filename):
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("systemctl", filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except ImportError: # python2
+        import imp
+        module = imp.load_source("systemctl", filename)
+    return module
+
+def best_of(repeat, func, *args):
+    """ run the func a number of times and return the fastest time """
+    best = None
+    for _ in range(max(1, repeat)):
+        started = time.time()
+        func(*args)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def systemctl_for(systemctl, root):
+    """ the module options are usually set in the systemctl.py main """
+    systemctl._root = root
+    systemctl._init = False
+    systemctl._unit_cache_file = None # not part of the measurement
+    return systemctl.Systemctl()
+
+def text_file(filename, content):
+    dirpath = os.path.dirname(filename)
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+    with open(filename, "w") as f:
+        f.write(content)
+
+def synthetic_unit(num):
+    """ a unit file with the usual mix of settings, comments and continuations """
+    return """# synthetic unit %(num)s
+[Unit]
+Description=Synthetic Service %(num)s
+After=network.target syn-%(prev)s.service
+Wants=syn-%(prev)s.service
+
+[Service]
+; a comment in the middle
+Type=simple
+Environment=NUM=%(num)s "TEXT=some text"
+Environment=MORE=%(num)s
+EnvironmentFile=-/etc/sysconfig/syn-%(num)s
+ExecStartPre=/bin/true
+ExecStart=/usr/bin/syn-daemon --num=%(num)s \\
+   --foreground \\
+   --config=/etc/syn/%(num)s.conf
+ExecReload=/bin/kill -HUP $MAINPID
+Restart=on-failure
+TimeoutStartSec=10
+
+[Install]
+WantedBy=multi-user.target
+""" % { "num": num, "prev": max(0, num - 1) }
+
+def bench_parse(systemctl, tmpdir, opt):
+    """ parse throughput of SystemctlConfigParser.read_sysd """
+    count = opt.units
+    folder = os.path.join(tmpdir, "parse")
+    filenames = []
+    for num in range(count):
+        filename = os.path.join(folder, "syn-%s.service" % num)
+        text_file(filename, synthetic_unit(num))
+        filenames.append(filename)
+    size = sum([ os.path.getsize(filename) for filename in filenames ])
+    def parse_all():
+        for filename in filenames:
+            parser = systemctl.UnitConfParser()
+            parser.read_sysd(filename)
+    elapsed = best_of(opt.repeat, parse_all)
+    results = []
+    results.append(("parse.units", count, "units"))
+    results.append(("parse.time", elapsed, "sec"))
+    results.append(("parse.throughput", count / elapsed, "units/sec"))
+    results.append(("parse.bandwidth", size / elapsed / 1024 / 1024, "MB/sec"))
+    return results
+
+def bench_memory(systemctl, tmpdir, opt):
+    """ memory of the loaded units as kept by a long running --init process """
+    try:
+        import tracemalloc
+    except ImportError: # python2
+        logg.warning("no tracemalloc - skipping the memory report")
+        return []
+    count = opt.loaded
+    root = os.path.join(tmpdir, "memory")
+    for num in range(count):
+        filename = os.path.join(root, "etc/systemd/system/syn-%s.service" % num)
+        text_file(filename, synthetic_unit(num))
+    systemctl_cmd = systemctl_for(systemctl, root)
+    units = systemctl_cmd.match_units() # the unit index is not measured
+    tracemalloc.start()
+    started, _ = tracemalloc.get_traced_memory()
+    confs = []
+    for unit in units:
+        conf = systemctl_cmd.load_unit_conf(unit)
+        conf.name(), conf.loaded()
+        systemctl_cmd.get_TimeoutStartSec(conf)
+        confs.append(conf)
+    current, peak = tracemalloc.get_traced_memory()
+    if opt.verbose:
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:5]:
+            logg.info("memory %s", stat)
+    tracemalloc.stop()
+    size = current - started
+    results = []
+    results.append(("memory.units", len(confs), "units"))
+    results.append(("memory.loaded", size / 1024.0, "KB"))
+    results.append(("memory.peak", (peak - started) / 1024.0, "KB"))
+    results.append(("memory.per_unit", size / float(max(1, len(confs))), "bytes/unit"))
+    return results
+
+def drop_caches():
+    """ a cold page cache needs root - returns False if not possible """
+    try:
+        if hasattr(os, "sync"):
+            os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except (IOError, OSError) as e:
+        logg.debug("can not drop caches: %s", e)
+        return False
+
+def bench_load(systemctl, tmpdir, opt):
+    """ serial and threaded loading of all unit files (list-units style) """
+    count = opt.loaded
+    root = os.path.join(tmpdir, "load")
+    for num in range(count):
+        filename = os.path.join(root, "etc/systemd/system/syn-%s.service" % num)
+        text_file(filename, synthetic_unit(num))
+        if num % 10 == 0:
+            filename = os.path.join(root, "etc/systemd/system/syn-%s.service.d/extra.conf" % num)
+            text_file(filename, "[Service]\nEnvironment=EXTRA=%s\n" % num)
+    threads = getattr(systemctl, "LoadUnitThreads", 1)
+    results = []
+    cold = True
+    for name, numthreads in [ ("serial", 1), ("parallel", max(2, threads)) ]:
+        best = None
+        for _ in range(max(1, opt.repeat)):
+            if not drop_caches():
+                cold = False
+            systemctl.LoadUnitThreads = numthreads
+            systemctl_cmd = systemctl_for(systemctl, root)
+            started = time.time()
+            units = systemctl_cmd.match_units()
+            if hasattr(systemctl_cmd, "load_unit_confs"):
+                systemctl_cmd.load_unit_confs(units)
+            for unit in units:
+                systemctl_cmd.get_unit_conf(unit)
+            elapsed = time.time() - started
+            if best is None or elapsed < best:
+                best = elapsed
+        results.append(("load.%s.threads" % name, numthreads, "threads"))
+        results.append(("load.%s.time" % name, best, "sec"))
+        results.append(("load.%s.throughput" % name, count / best, "units/sec"))
+    if not cold:
+        logg.warning("the page cache could not be dropped - the load times are warm")
+    results.append(("load.cold", cold and "yes" or "no", "page cache dropped"))
+    return results
+
+def synthetic_tree(root, count, fanout = 3, fanin = 2, seed = 1):
+    """ a --root tree with count services. Each one is ordered After= some
+        of the earlier ones (fanout) and Requires= one of those, and every
+        unit Wants= and is After= the same hub services (fanin). Every 10th
+        service is an instance of a template and every 10th one has a
+        drop-in, every 3rd one is enabled in the multi-user.target """
+    rand = random.Random(seed)
+    folder = os.path.join(root, "etc/systemd/system")
+    wants = os.path.join(folder, "multi-user.target.wants")
+    os.makedirs(wants)
+    text_file(os.path.join(folder, "multi-user.target"), "[Unit]\nDescription=Multi-User\n")
+    text_file(os.path.join(folder, "syn@.service"), 
+        "[Unit]\nDescription=Synthetic Template %i\n"
+        "[Service]\nExecStart=/usr/bin/syn-daemon --num=%i\n")
+    hubs = [ "hub-%s.service" % num for num in range(fanin) ]
+    for hub in hubs:
+        text_file(os.path.join(folder, hub), "[Unit]\nDescription=Hub\n"
+            "[Service]\nExecStart=/usr/bin/syn-daemon\n")
+    names = []
+    for num in range(count):
+        if num % 10 == 5:
+            names.append("syn@%s.service" % num)
+            continue
+        name = "syn-%s.service" % num
+        after = rand.sample(names, min(fanout, len(names)))
+        lines = [ "[Unit]", "Description=Synthetic Service %s" % num ]
+        if hubs:
+            lines.append("Wants=%s" % " ".join(hubs))
+        lines.append("After=%s" % " ".join(hubs + after))
+        if after:
+            lines.append("Requires=%s" % after[0])
+        lines += [ "", "[Service]", "ExecStart=/usr/bin/syn-daemon --num=%s" % num, 
+                   "", "[Install]", "WantedBy=multi-user.target" ]
+        text_file(os.path.join(folder, name), "\n".join(lines) + "\n")
+        if num % 10 == 0:
+            text_file(os.path.join(folder, name + ".d", "extra.conf"),
+                "[Service]\nEnvironment=EXTRA=%s\n" % num)
+        if num % 3 == 0:
+            os.symlink(os.path.join("..", name), os.path.join(wants, name))
+        names.append(name)
+    return names
+
+def graph_sizes(opt): # -> [ count,.. ]
+    return [ int(size) for size in opt.sizes.split(",") if size.strip() ]
+
+def graph_tree(tmpdir, count, opt): # -> root, names
+    """ the synthetic tree of a size is shared by the graph benchmarks """
+    root = os.path.join(tmpdir, "graph-%s" % count)
+    names_file = os.path.join(root, "names.json")
+    if os.path.exists(names_file):
+        with open(names_file) as f:
+            return root, json.load(f)
+    names = synthetic_tree(root, count, opt.fanout, opt.fanin, opt.seed)
+    with open(names_file, "w") as f:
+        json.dump(names, f)
+    return root, names
+
+def graph_systemctl(systemctl, root, names): # -> Systemctl
+    """ the unit files are loaded already - that is not measured here """
+    systemctl_cmd = systemctl_for(systemctl, root)
+    units = systemctl_cmd.match_units()
+    if hasattr(systemctl_cmd, "load_unit_confs"):
+        systemctl_cmd.load_unit_confs(units)
+    for name in names:
+        systemctl_cmd.get_unit_conf(name)
+    return systemctl_cmd
+
+def bench_ordering(systemctl, tmpdir, opt):
+    """ the start order (sortedAfter) of all services in a unit graph """
+    results = []
+    for count in graph_sizes(opt):
+        root, names = graph_tree(tmpdir, count, opt)
+        systemctl_cmd = graph_systemctl(systemctl, root, names)
+        confs = [ systemctl_cmd.get_unit_conf(name) for name in names ]
+        elapsed = best_of(opt.repeat, systemctl.sortedAfter, confs)
+        results.append(("ordering.%s.time" % count, elapsed, "sec"))
+        results.append(("ordering.%s.throughput" % count, count / elapsed, "units/sec"))
+    return results
+
+def bench_matching(systemctl, tmpdir, opt):
+    """ match_units for the usual kinds of unit arguments """
+    results = []
+    for count in graph_sizes(opt):
+        root, names = graph_tree(tmpdir, count, opt)
+        systemctl_cmd = graph_systemctl(systemctl, root, names)
+        modules = [ "syn-1.service", "syn-1", "syn-1*", "syn@*", "syn@5.service", "*.target", "hub-*" ]
+        def match_all():
+            for _ in range(10):
+                for module in modules:
+                    systemctl_cmd.match_units([ module ])
+        elapsed = best_of(opt.repeat, match_all) / (10 * len(modules))
+        results.append(("matching.%s.time" % count, elapsed * 1000, "msec/match"))
+    return results
+
+def bench_dependencies(systemctl, tmpdir, opt):
+    """ get_dependencies_unit for all services and list-dependencies of the target """
+    results = []
+    for count in graph_sizes(opt):
+        root, names = graph_tree(tmpdir, count, opt)
+        systemctl_cmd = graph_systemctl(systemctl, root, names)
+        def deps_all():
+            for name in names:
+                systemctl_cmd.get_dependencies_unit(name)
+        elapsed = best_of(opt.repeat, deps_all)
+        results.append(("dependencies.%s.time" % count, elapsed, "sec"))
+        lines = []
+        def list_dependencies():
+            systemctl_cmd = graph_systemctl(systemctl, root, names)
+            lines[:] = systemctl_cmd.list_dependencies_units([ "multi-user.target" ])
+        elapsed = best_of(opt.repeat, list_dependencies)
+        results.append(("list-dependencies.%s.time" % count, elapsed, "sec"))
+        results.append(("list-dependencies.%s.lines" % count, len(lines), "lines"))
+    return results
+
+def print_results(results, output = None):
+    lines = []
+    for name, value, unit in results:
+        if isinstance(value, float):
+            lines.append("%-30s %14.3f %s" % (name, value, unit))
+        else:
+            lines.append("%-30s %14s %s" % (name, value, unit))
+    for line in lines:
+        print(line)
+    if output:
+        with open(output, "w") as f:
+            for line in lines:
+                f.write(line + "\n")
+        logg.info("results saved to %s", output)
+
+def save_json(results, filename, opt):
+    """ the results with the settings that they were measured with """
+    data = {}
+    data["systemctl"] = opt.systemctl_py
+    data["python"] = "%s.%s.%s" % sys.version_info[:3]
+    data["settings"] = { "units": opt.units, "loaded": opt.loaded, "repeat": opt.repeat,
+        "sizes": graph_sizes(opt), "fanout": opt.fanout, "fanin": opt.fanin, "seed": opt.seed }
+    data["results"] = [ { "name": name, "value": value, "unit": unit } for name, value, unit in results ]
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+    logg.info("json saved to %s", filename)
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    _o = OptionParser("%prog [options] bench*",
+       epilog=__doc__.strip().split("\n")[0])
+    _o.add_option("-v","--verbose", action="count", default=0,
+       help="increase logging level [%default]")
+    _o.add_option("--with", metavar="FILE", dest="systemctl_py", default=_systemctl_py,
+       help="systemctl.py file to be measured (%default)")
+    _o.add_option("-n","--units", metavar="NUM", type="int", default=10000,
+       help="number of synthetic unit files [%default]")
+    _o.add_option("-m","--loaded", metavar="NUM", type="int", default=1000,
+       help="number of loaded units for the memory report [%default]")
+    _o.add_option("-r","--repeat", metavar="NUM", type="int", default=3,
+       help="take the best time of a number of runs [%default]")
+    _o.add_option("-o","--output", metavar="FILE", default="",
+       help="additionally save the results to a file [%default]")
+    _o.add_option("-s","--sizes", metavar="LIST", default="10,100,1000,10000",
+       help="number of units in the graph trees [%default]")
+    _o.add_option("--fanout", metavar="NUM", type="int", default=3,
+       help="After= edges of each unit in the graph trees [%default]")
+    _o.add_option("--fanin", metavar="NUM", type="int", default=2,
+       help="hub units that every unit depends on in the graph trees [%default]")
+    _o.add_option("--seed", metavar="NUM", type="int", default=1,
+       help="random seed for the graph trees [%default]")
+    _o.add_option("-j","--json", metavar="FILE", default="",
+       help="additionally save the results as json [%default]")
+    _o.add_option("--keep", action="store_true", default=False,
+       help="keep the temp folder with the synthetic files [%default]")
+    opt, args = _o.parse_args()
+    logging.basicConfig(level = logging.WARNING - opt.verbose * 5)
+    #
+    systemctl = load_systemctl(opt.systemctl_py)
+    if not args: args = [ "bench_*" ]
+    from fnmatch import fnmatchcase as fnmatch
+    tmpdir = tempfile.mkdtemp(prefix="systemctl-bench.")
+    results = []
+    try:
+        for funcname in sorted(globals()):
+            if not funcname.startswith("bench_"):
+                continue
+            for arg in args:
+                if fnmatch(funcname, arg) or fnmatch(funcname, "bench_" + arg):
+                    logg.info("running %s", funcname)
+                    results += globals()[funcname](systemctl, tmpdir, opt)
+                    break
+    finally:
+        if opt.keep:
+            logg.warning("keeping %s", tmpdir)
+        else:
+            shutil.rmtree(tmpdir)
+    print_results(results, opt.output)
+    if opt.json:
+        save_json(results, opt.json, opt)
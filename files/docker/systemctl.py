@@ -19,20 +19,35 @@ import sys
 import signal
 import time
 import socket
+import select
+import json
+import threading
 import datetime
 import fcntl
+import stat
+import struct
+import marshal
 
 if sys.version[0] == '2':
     string_types = basestring
     BlockingIOError = IOError
+    selectors = None
 else:
     string_types = str
     xrange = range
+    intern = sys.intern
+    import selectors
+
+if sys.version_info >= (3, 7):
+    ordered_dict = dict # keeps the insertion order
+else:
+    ordered_dict = collections.OrderedDict
 
 COVERAGE = os.environ.get("SYSTEMCTL_COVERAGE", "")
 DEBUG_AFTER = os.environ.get("SYSTEMCTL_DEBUG_AFTER", "") or False
 EXIT_WHEN_NO_MORE_PROCS = os.environ.get("SYSTEMCTL_EXIT_WHEN_NO_MORE_PROCS", "") or False
 EXIT_WHEN_NO_MORE_SERVICES = os.environ.get("SYSTEMCTL_EXIT_WHEN_NO_MORE_SERVICES", "") or False
+NO_PIDFD = os.environ.get("SYSTEMCTL_NO_PIDFD", "") or False # kill by pid only
 
 FOUND_OK = 0
 FOUND_INACTIVE = 2
@@ -42,6 +57,7 @@ FOUND_UNKNOWN = 4
 _extra_vars = []
 _force = False
 _full = False
+_job_mode = "replace"
 _now = False
 _no_legend = False
 _no_ask_password = False
@@ -52,7 +68,9 @@ _unit_type = None
 _unit_state = None
 _unit_property = None
 _show_all = False
+_reverse = False
 _user_mode = False
+_output = None
 
 # common default paths
 _default_target = "multi-user.target"
@@ -86,7 +104,12 @@ DefaultTimeoutStartSec = int(os.environ.get("SYSTEMCTL_TIMEOUT_START_SEC", 90))
 DefaultTimeoutStopSec = int(os.environ.get("SYSTEMCTL_TIMEOUT_STOP_SEC", 90))   # official value
 DefaultMaximumTimeout = int(os.environ.get("SYSTEMCTL_MAXIMUM_TIMEOUT", 200))   # overrides all other
 InitLoopSleep = int(os.environ.get("SYSTEMCTL_INITLOOP", 5))
+LoadUnitThreads = int(os.environ.get("SYSTEMCTL_LOAD_THREADS", 4)) # bulk loading
+UnitJobs = int(os.environ.get("SYSTEMCTL_JOBS", 4)) # 1 = one after another
+DefaultTimeoutShutdownSec = int(os.environ.get("SYSTEMCTL_TIMEOUT_SHUTDOWN_SEC", 9)) # docker stop waits 10s
 ProcMaxDepth = 100
+UnitIndexVersion = 4
+UnitIndexRacy = 2 # seconds, the mtime granularity of some filesystems
 MaxLockWait = None # equals DefaultMaximumTimeout
 DefaultPath = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
 ResetLocale = ["LANG", "LANGUAGE", "LC_CTYPE", "LC_NUMERIC", "LC_TIME", "LC_COLLATE", "LC_MONETARY",
@@ -97,6 +120,9 @@ ResetLocale = ["LANG", "LANGUAGE", "LC_CTYPE", "LC_NUMERIC", "LC_TIME", "LC_COLL
 _notify_socket_folder = "/var/run/systemd" # alias /run/systemd
 _pid_file_folder = "/var/run"
 _journal_log_folder = "/var/log/journal"
+_unit_index_file = "systemctl.units.index" # in _notify_socket_folder
+_unit_cache_file = "systemctl.units.cache" # in _notify_socket_folder
+_init_pid_file = "systemctl.init.pid" # in _notify_socket_folder
 
 _systemctl_debug_log = "/var/log/systemctl.debug.log"
 _systemctl_extra_log = "/var/log/systemctl.log"
@@ -149,6 +175,45 @@ def os_path(root, path):
         path = path[1:]
     return os.path.join(root, path)
 
+def os_folder_mtime(path):
+    """ the mtime of a directory or None if it is not a directory """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return None
+    return st.st_mtime
+
+def marshal_load(filename, version): # -> data?
+    """ read a cache file written by marshal_save (with the same version) """
+    if not filename or not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, "rb") as f:
+            data = marshal.loads(f.read())
+    except Exception as e:
+        logg.debug("bad cache file %s: %s", filename, e)
+        return None
+    if not isinstance(data, dict) or data.get("version") != version:
+        return None
+    return data
+
+def marshal_save(filename, data): # -> bool(written)
+    """ atomically replace a cache file, it is fine if that is not possible """
+    tmpfile = "%s.%s" % (filename, os.getpid())
+    try:
+        dirpath = os.path.dirname(filename)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        with open(tmpfile, "wb") as f:
+            f.write(marshal.dumps(data))
+        os.rename(tmpfile, filename)
+    except (IOError, OSError) as e:
+        logg.debug("can not write cache file %s: %s", filename, e)
+        return False
+    return True
+
 def os_getlogin():
     """ NOT using os.getlogin() """
     import pwd
@@ -209,11 +274,20 @@ def shutil_setuid(user = None, group = None, xgroups = None):
         return { "USER": user, "LOGNAME": logname, "HOME": home, "SHELL": shell }
     return {}
 
+def shutil_makedirs(dirpath):
+    """ creates the folder unless it exists (which may happen in parallel
+        by another start/stop job worker) """
+    try:
+        os.makedirs(dirpath)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dirpath):
+            raise
+
 def shutil_truncate(filename):
     """ truncates the file (or creates a new empty file)"""
     filedir = os.path.dirname(filename)
     if not os.path.isdir(filedir):
-        os.makedirs(filedir)
+        shutil_makedirs(filedir)
     f = open(filename, "w")
     f.write("")
     f.close()
@@ -276,6 +350,98 @@ def _pid_zombie(pid):
             logg.error("%s (%s): %s", check, e.errno, e)
         return False
     return False
+class ProcSnapshot:
+    """ pid => (ppid, state, starttime) of all processes from a single
+        scan of /proc, done on first use and kept until refresh(). The
+        places that fork, kill or wait for processes do refresh() later.
+        While a unit job is changing the processes (see changing) the
+        pid lookups read /proc/<pid>/stat directly. """
+    def __init__(self):
+        self.procs = None
+        self.childmap = None
+        self.live = 0
+    def refresh(self):
+        self.procs = None
+        self.childmap = None
+    def changing(self):
+        """ context of a unit job - lookups are live until its exit """
+        return self
+    def __enter__(self):
+        self.live += 1
+        return self
+    def __exit__(self, *args):
+        self.live -= 1
+        self.refresh()
+    def read(self, pid): # -> (ppid, state, starttime)?
+        """ the comm name in the stat file is parenthesized and may contain
+            blanks or parentheses - the fields follow after the last ')' """
+        proc_stat = "/proc/%s/stat" % pid
+        try:
+            with open(proc_stat) as f:
+                text = f.read()
+        except IOError as e:
+            if e.errno not in [ errno.ENOENT, errno.ESRCH ]:
+                logg.warning("%s : %s", proc_stat, e)
+            return None # process is gone meanwhile
+        fields = text.rsplit(")", 1)[-1].split()
+        try:
+            return int(fields[1]), fields[0], int(fields[19])
+        except (IndexError, ValueError):
+            return None
+    def scan(self):
+        procs = {}
+        for name in os.listdir("/proc"):
+            try: pid = int(name)
+            except: continue
+            found = self.read(pid)
+            if found is not None:
+                procs[pid] = found
+        return procs
+    def table(self):
+        if self.live:
+            return self.scan()
+        if self.procs is None:
+            self.procs = self.scan()
+        return self.procs
+    def get(self, pid):
+        try: pid = int(pid)
+        except: return None
+        if pid <= 0:
+            return None
+        if self.live:
+            return self.read(pid)
+        return self.table().get(pid)
+    def alive(self, pid):
+        """ the pid exists and it is not a zombie """
+        found = self.get(pid)
+        return found is not None and found[1] not in [ "Z", "X" ]
+    def children(self):
+        """ ppid => [ pid,.. ] """
+        if self.childmap is not None and not self.live:
+            return self.childmap
+        childmap = {}
+        for pid, (ppid, state, starttime) in self.table().items():
+            childmap.setdefault(ppid, []).append(pid)
+        if not self.live:
+            self.childmap = childmap
+        return childmap
+    def boottime(self):
+        """ the starttime ticks are counted from the kernel btime """
+        try:
+            for line in open("/proc/stat"):
+                if line.startswith("btime"):
+                    return int(line.split()[1])
+        except (IOError, IndexError, ValueError) as e:
+            logg.warning("/proc/stat btime: %s", e)
+        return None
+    def started(self):
+        """ the start time of the oldest process (or None) """
+        booted = self.boottime()
+        procs = self.table()
+        if booted is None or not procs:
+            return None
+        ticks = min([ starttime for ppid, state, starttime in procs.values() ])
+        return booted + float(ticks) / os.sysconf("SC_CLK_TCK")
 
 def checkstatus(cmd):
     if cmd.startswith("-"):
@@ -289,16 +455,19 @@ def ignore_signals_and_raise_keyboard_interrupt(signame):
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     raise KeyboardInterrupt(signame)
 
-class SystemctlConfigParser:
+IniSettingLine = re.compile(r"(\w+) *=(.*)")
+
+class SystemctlConfigParser(object):
     """ A *.service files has a structure similar to an *.ini file but it is
         actually not like it. Settings may occur multiple times in each section
         and they create an implicit list. In reality all the settings are
         globally uniqute, so that an 'environment' can be printed without
         adding prefixes. Settings are continued with a backslash at the end
-        of the line.  """
+        of the line.  The values of a setting are kept as a tuple. """
+    __slots__ = ["_defaults", "_dict_type", "_allow_no_value", "_conf", "_files"]
     def __init__(self, defaults=None, dict_type=None, allow_no_value=False):
         self._defaults = defaults or {}
-        self._dict_type = dict_type or collections.OrderedDict
+        self._dict_type = dict_type or ordered_dict
         self._allow_no_value = allow_no_value
         self._conf = self._dict_type()
         self._files = []
@@ -319,11 +488,11 @@ class SystemctlConfigParser:
         if section not in self._conf:
             self._conf[section] = self._dict_type()
         if option not in self._conf[section]:
-            self._conf[section][option] = [ value ]
+            self._conf[section][option] = ( value, )
         else:
-            self._conf[section][option].append(value)
+            self._conf[section][option] += ( value, )
         if value is None:
-            self._conf[section][option] = []
+            self._conf[section][option] = ()
     def get(self, section, option, default = None, allow_no_value = False):
         allow_no_value = allow_no_value or self._allow_no_value
         if section not in self._conf:
@@ -363,57 +532,77 @@ class SystemctlConfigParser:
             if allow_no_value:
                 return []
             raise AttributeError("option {} in {} does not exist".format(option, section))
-        return self._conf[section][option] # returns a list, possibly empty
+        return list(self._conf[section][option]) # returns a list, possibly empty
     def read(self, filename):
         return self.read_sysd(filename)
     def read_sysd(self, filename):
-        initscript = False
-        initinfo = False
+        """ single pass over the whole file - a line ending with a backslash
+            is continued (empty lines within are dropped), an empty value
+            resets the list of values of that setting. """
         section = None
-        nextline = False
-        name, text = "", ""
+        options = None
+        name, parts = "", None
         if os.path.isfile(filename):
             self._files.append(filename)
-        for orig_line in open(filename):
-            if nextline:
-                text += orig_line
-                if text.rstrip().endswith("\\") or text.rstrip().endswith("\\\n"):
-                    text = text.rstrip() + "\n"
-                else:
-                    self.set(section, name, text)
-                    nextline = False
+        with open(filename) as f:
+            lines = f.read().split("\n")
+        last = len(lines) - 1
+        for num, orig_line in enumerate(lines):
+            if parts is not None:
+                line = orig_line.rstrip()
+                if not line:
+                    continue
+                if line.endswith("\\"):
+                    parts.append(line + "\n")
+                    continue
+                parts.append(num < last and orig_line + "\n" or orig_line)
+                options = self._setlist(section, options, name, "".join(parts))
+                parts = None
                 continue
             line = orig_line.strip()
             if not line:
                 continue
-            if line.startswith("#"):
+            first = line[0]
+            if first == "#" or first == ";":
                 continue
-            if line.startswith(";"):
+            if first == "[":
+                x = line.find("]")
+                if x > 0:
+                    section = intern(line[1:x])
+                    self.add_section(section)
+                    options = self._conf[section]
                 continue
-            if line.startswith(".include"):
+            if first == "." and line.startswith(".include"):
                 logg.error("the '.include' syntax is deprecated. Use x.service.d/ drop-in files!")
                 includefile = re.sub(r'^\.include[ ]*', '', line).rstrip()
                 if not os.path.isfile(includefile):
                     raise Exception("tried to include file that doesn't exist: %s" % includefile)
                 self.read_sysd(includefile)
+                options = None # may have been created in the include file
                 continue
-            if line.startswith("["):
-                x = line.find("]")
-                if x > 0:
-                    section = line[1:x]
-                    self.add_section(section)
-                continue
-            m = re.match(r"(\w+) *=(.*)", line)
+            m = IniSettingLine.match(line)
             if not m:
                 logg.warning("bad ini line: %s", line)
                 raise Exception("bad ini line")
-            name, text = m.group(1), m.group(2).strip()
-            if text.endswith("\\") or text.endswith("\\\n"):
-                nextline = True
-                text = text + "\n"
+            name, text = intern(m.group(1)), m.group(2).strip()
+            if text.endswith("\\"):
+                parts = [ text + "\n" ]
             else:
                 # hint: an empty line shall reset the value-list
-                self.set(section, name, text and text or None)
+                options = self._setlist(section, options, name, text or None)
+    def _setlist(self, section, options, name, value):
+        """ same as set() but with the options-dict of the section at hand """
+        if options is None:
+            if section not in self._conf:
+                self._conf[section] = self._dict_type()
+            options = self._conf[section]
+        if value is None:
+            options[name] = ()
+        elif name in options:
+            options[name] += ( value, )
+        else:
+            options[name] = ( value, )
+        return options
     def read_sysv(self, filename):
         """ an LSB header is scanned and converted to (almost)
             equivalent settings of a SystemD ini-style input """
@@ -456,20 +645,41 @@ class SystemctlConfigParser:
         self.set("Service", "Type", "sysv")
     def filenames(self):
         return self._files
+    def dump_sections(self):
+        """ the parsed settings in a compact form (for the unit cache) """
+        sections = []
+        for section, options in self._conf.items():
+            items = tuple(options.items())
+            sections.append((section, items))
+        return tuple(sections)
+    def load_sections(self, sections, filenames):
+        """ restore the settings from dump_sections (from the unit cache) """
+        for section, items in sections:
+            if section is not None:
+                section = intern(section)
+            options = self._conf.setdefault(section, self._dict_type())
+            for option, values in items:
+                options[intern(option)] = tuple(values)
+        self._files.extend(filenames)
 
 # UnitConfParser = ConfigParser.RawConfigParser
 UnitConfParser = SystemctlConfigParser
 
-class SystemctlConf:
+class SystemctlConf(object):
+    """ the parsed unit data with the derived values (until the next set) """
+    __slots__ = ["data", "status", "masked", "module", "drop_in_files", "_root", "_user_mode",
+                 "_filename", "_name", "_memo"]
     def __init__(self, data, module = None):
         self.data = data # UnitConfParser
-        self.env = {}
         self.status = None
         self.masked = None
         self.module = module
         self.drop_in_files = {}
         self._root = _root
         self._user_mode = _user_mode
+        self._filename = False # not yet known
+        self._name = None
+        self._memo = None
     def os_path(self, path):
         return os_path(self._root, path)
     def os_path_var(self, path):
@@ -477,29 +687,43 @@ class SystemctlConf:
             return os_path(self._root, _var_path(path))
         return os_path(self._root, path)
     def loaded(self):
-        files = self.data.filenames()
         if self.masked:
             return "masked"
-        if len(files):
+        if self.filename():
             return "loaded"
         return ""
     def filename(self):
         """ returns the last filename that was parsed """
-        files = self.data.filenames()
-        if files:
-            return files[0]
-        return None
+        if self._filename is False:
+            files = self.data.filenames()
+            self._filename = files and files[0] or None
+        return self._filename
     def overrides(self):
         """ drop-in files are loaded alphabetically by name, not by full path """
         return [ self.drop_in_files[name] for name in sorted(self.drop_in_files) ]
     def name(self):
         """ the unit id or defaults to the file name """
-        name = self.module or ""
-        filename = self.filename()
-        if filename:
-            name = os.path.basename(filename)
-        return self.get("Unit", "Id", name)
+        if self._name is None:
+            name = self.module or ""
+            filename = self.filename()
+            if filename:
+                name = os.path.basename(filename)
+            self._name = self.get("Unit", "Id", name)
+        return self._name
+    def dependencies(self):
+        """ the After/Before/Requires/.. settings as a UnitDependencies record """
+        return self.memo("dependencies", lambda: UnitDependencies(self))
+    def memo(self, key, func):
+        """ a value derived from the settings is computed only once """
+        if self._memo is None:
+            self._memo = {}
+        if key not in self._memo:
+            self._memo[key] = func()
+        return self._memo[key]
     def set(self, section, name, value):
+        self._filename = False
+        self._name = None
+        self._memo = None
         return self.data.set(section, name, value)
     def get(self, section, name, default, allow_no_value = False):
         return self.data.get(section, name, default, allow_no_value)
@@ -545,7 +769,7 @@ class waitlock:
         try:
             folder = self.lockfolder
             if not os.path.isdir(folder):
-                os.makedirs(folder)
+                shutil_makedirs(folder)
         except Exception as e:
             logg.warning("oops, %s", e)
     def lockfile(self):
@@ -598,6 +822,180 @@ class waitlock:
         except Exception as e:
             logg.warning("oops, %s", e)
 
+class InitProcess:
+    """ the lifetime of a systemctl init process - a SIGHUP is taken as a
+        daemon-reload all along (also while the units are started or stopped)
+        and the pid file (with the starttime against a reused pid) tells a
+        'systemctl daemon-reload' where to send it. """
+    def __init__(self, systemctl):
+        self.systemctl = systemctl
+        self.pidfile = systemctl.cache_file(_init_pid_file)
+    def __enter__(self):
+        systemctl = self.systemctl
+        signal.signal(signal.SIGHUP, lambda signum, frame: systemctl.request_unit_reload())
+        signal.siginterrupt(signal.SIGHUP, False) # no EINTR in a waitpid (python2)
+        pid = os.getpid()
+        found = ProcSnapshot().read(pid)
+        try:
+            shutil_makedirs(os.path.dirname(self.pidfile))
+            with open(self.pidfile, "w") as f:
+                f.write("%s %s\n" % (pid, found and found[2]))
+        except (IOError, OSError) as e:
+            logg.warning("can not write %s: %s", self.pidfile, e)
+        return self
+    def __exit__(self, type, value, traceback):
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        if read_init_pid(self.pidfile) == os.getpid():
+            try:
+                os.remove(self.pidfile)
+            except OSError as e:
+                logg.debug("can not remove %s: %s", self.pidfile, e)
+
+def read_init_pid(pidfile): # -> pid?
+    """ the pid of the running init process (see InitProcess) """
+    try:
+        with open(pidfile) as f:
+            pid, starttime = f.read().split()[:2]
+    except (IOError, OSError, ValueError):
+        return None
+    found = ProcSnapshot().read(pid)
+    if not found or str(found[2]) != starttime or found[1] in [ "Z", "X" ]:
+        logg.debug("stale init pid file %s", pidfile)
+        return None
+    return int(pid)
+
+# a requested job attaches to a queued job of one of these types
+JobAttachTo = { "start": [ "start", "restart" ], "stop": [ "stop" ],
+                "reload": [ "reload", "restart" ], "restart": [ "restart" ] }
+# a pending job (first) is merged with the requested job (second) into
+JobMergeInto = { ("start", "restart"): "restart", ("reload", "restart"): "restart" }
+JobHistory = 10 # finished jobs are kept for the attached requests
+
+## job = UnitJobQueue(conf).submit("start") ... with waitlock(conf): ...
+class UnitJobQueue:
+    """ The start/stop/reload/restart jobs of a unit are noted in a job file
+        next to its lock file, so that concurrent systemctl calls can merge
+        their requests the way systemd does: a request attaches to a queued
+        job with the same effect and shares its result, a pending job can be
+        merged into a restart, and a conflicting pending job is canceled
+        (--job-mode=replace) or the request is refused (--job-mode=fail). """
+    def __init__(self, conf):
+        self.conf = conf
+        self.jobfolder = conf.os_path_var(_notify_socket_folder)
+    def jobfile(self):
+        return os.path.join(self.jobfolder, str(self.conf.name() or "global") + ".jobs")
+    def update(self, func): # -> func(data)
+        """ read-modify-write of the job file while holding its flock """
+        if not os.path.isdir(self.jobfolder):
+            shutil_makedirs(self.jobfolder)
+        opened = os.open(self.jobfile(), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(opened, fcntl.LOCK_EX)
+            text = b""
+            while True:
+                buf = os.read(opened, 65536)
+                if not buf: break
+                text += buf
+            data = {}
+            try:
+                if text.strip():
+                    data = json.loads(text.decode("utf-8"))
+            except ValueError as e:
+                logg.warning("bad job file %s: %s", self.jobfile(), e)
+            data.setdefault("serial", 0)
+            data.setdefault("jobs", [])
+            for entry in list(data["jobs"]):
+                if entry["state"] in [ "pending", "running" ] and not self.owner_alive(entry):
+                    logg.info("job %s %s is gone with PID %s", entry["id"], entry["job"], entry["pid"])
+                    data["jobs"].remove(entry) # an attached client sees it as failed
+            result = func(data)
+            finished = [ entry for entry in data["jobs"] if entry["state"] not in [ "pending", "running" ] ]
+            for entry in finished[:-JobHistory]:
+                data["jobs"].remove(entry)
+            newtext = json.dumps(data).encode("utf-8")
+            if newtext != text:
+                os.lseek(opened, 0, os.SEEK_SET)
+                os.ftruncate(opened, 0)
+                os.write(opened, newtext)
+            return result
+        finally:
+            fcntl.flock(opened, fcntl.LOCK_UN)
+            os.close(opened)
+    def owner_alive(self, entry):
+        """ the pid of the job owner is checked with its start time as
+            the pid may have been reused after the owner was killed """
+        found = ProcSnapshot().read(entry["pid"])
+        if found is None or found[1] in [ "Z", "X" ]:
+            return False
+        return entry.get("started") in [ None, found[2] ]
+    def submit(self, job, job_mode = None): # -> (id, attached)?
+        """ queue a job - or attach to a queued job with the same effect.
+            Returns None when the job is refused by --job-mode=fail """
+        unit = self.conf.name()
+        def submit_job(data):
+            live = [ entry for entry in data["jobs"] if entry["state"] in [ "pending", "running" ] ]
+            if live and live[-1]["pid"] != os.getpid():
+                last = live[-1]
+                if last["job"] in JobAttachTo.get(job, []):
+                    logg.info("%s %s attached to %s job %s", job, unit, last["job"], last["id"])
+                    return last["id"], True
+                merged = JobMergeInto.get((last["job"], job))
+                if merged and last["state"] == "pending":
+                    logg.info("%s %s merged with %s job %s", job, unit, last["job"], last["id"])
+                    last["job"] = merged
+                    return last["id"], True
+            conflicts = [ entry for entry in live if entry["job"] != job and "stop" in [ job, entry["job"] ] ]
+            if conflicts and job_mode in [ "fail" ]:
+                logg.error("Transaction for %s/%s is destructive (%s job %s is queued)",
+                    unit, job, conflicts[0]["job"], conflicts[0]["id"])
+                return None
+            for entry in conflicts:
+                if entry["state"] == "pending":
+                    logg.info("%s %s replaces %s job %s", job, unit, entry["job"], entry["id"])
+                    entry["state"], entry["result"] = "canceled", False
+            data["serial"] += 1
+            owner = ProcSnapshot().read(os.getpid())
+            data["jobs"].append({ "id": data["serial"], "job": job, "pid": os.getpid(),
+                                  "started": owner and owner[2],
+                                  "state": "pending", "result": None, "since": time.time() })
+            return data["serial"], False
+        return self.update(submit_job)
+    def begin(self, jobid): # -> job?
+        """ the job type to be run now (it may have been merged) or None when canceled """
+        def begin_job(data):
+            for entry in data["jobs"]:
+                if entry["id"] == jobid and entry["state"] == "pending":
+                    entry["state"] = "running"
+                    return entry["job"]
+            return None
+        return self.update(begin_job)
+    def finish(self, jobid, result):
+        def finish_job(data):
+            for entry in data["jobs"]:
+                if entry["id"] == jobid and entry["state"] in [ "pending", "running" ]:
+                    entry["state"], entry["result"] = "done", bool(result)
+        self.update(finish_job)
+    def wait(self, jobid, timeout): # -> result
+        """ wait for an attached job to be finished by the other systemctl call
+            (failing after the timeout) """
+        deadline = time.time() + timeout
+        def job_result(data):
+            for entry in data["jobs"]:
+                if entry["id"] == jobid:
+                    if entry["state"] in [ "pending", "running" ]:
+                        return None
+                    return entry
+            return { "state": "done", "result": False } # forgotten
+        while True:
+            entry = self.update(job_result)
+            if entry is not None:
+                logg.debug("job %s is %s (%s)", jobid, entry["state"], entry["result"])
+                return entry["result"]
+            if time.time() > deadline:
+                logg.error("job %s for %s did not finish within %ss", jobid, self.conf.name(), timeout)
+                return False
+            time.sleep(EpsilonTime)
+
 def must_have_failed(waitpid, cmd):
     # found to be needed on ubuntu:16.04 to match test result from ubuntu:18.04 and other distros
     # .... I have tracked it down that python's os.waitpid() returns an exitcode==0 even when the
@@ -628,6 +1026,184 @@ def subprocess_testpid(pid):
     else:
         return testpid(pid, None, 0)
 
+def pidfds_of(pids): # -> { pid: pidfd }?
+    """ a pidfd refers to the process even when its pid gets reused. It is
+        None without pidfd support (python < 3.9, linux < 5.3) - and a pid
+        that is gone already has no entry. """
+    if NO_PIDFD or not hasattr(os, "pidfd_open") or not hasattr(signal, "pidfd_send_signal"):
+        logg.debug("no pidfd for PIDs %s - using plain pids", pids)
+        return None
+    pidfds = {}
+    for pid in pids:
+        try:
+            pidfds[pid] = os.pidfd_open(pid)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                continue
+            logg.debug("no pidfd for PID %s: %s", pid, e)
+            pidfds_close(pidfds)
+            return None
+    logg.debug("pidfd for PIDs %s", sorted(pidfds))
+    return pidfds
+def pidfds_wait(pidfds, timeout): # -> [ pid,.. ] still running
+    """ wait for the processes to exit - a pidfd gets readable on exit """
+    deadline = time.time() + timeout
+    running = dict([ (pidfd, pid) for pid, pidfd in pidfds.items() ])
+    poller = select.poll()
+    for pidfd in running:
+        poller.register(pidfd, select.POLLIN)
+    while running:
+        remaining = max(0, deadline - time.time())
+        try:
+            events = poller.poll(int(remaining * 1000))
+        except (select.error, OSError) as e:
+            if e.args and e.args[0] == errno.EINTR:
+                continue
+            raise
+        for pidfd, event in events:
+            poller.unregister(pidfd)
+            del running[pidfd]
+        if not remaining:
+            break
+    return list(running.values())
+def pidfds_close(pidfds):
+    for pidfd in pidfds.values():
+        os.close(pidfd)
+
+class InotifyWatch:
+    """ the inotify syscalls (via ctypes) on a number of folders - the init-loop
+        is told about changed unit files without rescanning the unit folders """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    IN_CHANGES = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    IN_FILE_CHANGES = IN_CHANGES & ~IN_MODIFY # a file being written is seen when closed
+    def __init__(self, mask = IN_CHANGES):
+        self.mask = mask
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+        self._inotify_add_watch = libc.inotify_add_watch
+        self._inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+        self._inotify_rm_watch = libc.inotify_rm_watch
+        self._inotify_rm_watch.argtypes = [ ctypes.c_int, ctypes.c_int ]
+        self._get_errno = ctypes.get_errno
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+        self.folders = {} # wd => path
+        self.watches = {} # path => wd
+    def add(self, path):
+        if path in self.watches:
+            return True
+        filename = path
+        if not isinstance(filename, bytes):
+            filename = filename.encode("utf-8")
+        wd = self._inotify_add_watch(self.fd, filename, self.mask | self.IN_ONLYDIR)
+        if wd < 0:
+            logg.debug("inotify can not watch %s: %s", path, os.strerror(self._get_errno()))
+            return False
+        self.folders[wd] = path
+        self.watches[path] = wd
+        return True
+    def remove(self, path):
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            del self.folders[wd]
+            self._inotify_rm_watch(self.fd, wd)
+    def read(self): # -> [ (folder, name, mask),.. ]
+        """ all pending events (without waiting) - on an overflow the folder is None """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in [ errno.EAGAIN, errno.EINTR ]:
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset + 16 <= len(data):
+                wd, mask, cookie, size = struct.unpack_from("iIII", data, offset)
+                name = data[offset+16:offset+16+size].rstrip(b"\0")
+                offset += 16 + size
+                if not isinstance(name, str):
+                    name = name.decode("utf-8", "replace")
+                if mask & self.IN_Q_OVERFLOW:
+                    events.append((None, None, mask))
+                    continue
+                folder = self.folders.get(wd)
+                if mask & self.IN_IGNORED:
+                    if folder is not None:
+                        del self.folders[wd]
+                        del self.watches[folder]
+                    continue
+                if folder is not None:
+                    events.append((folder, name, mask))
+        return events
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.folders = {}
+        self.watches = {}
+
+class SignalWakeup:
+    """ a pipe given to signal.set_wakeup_fd - the init-loop waits on its
+        read end to be woken up by a SIGCHLD instead of a fixed sleep. Any
+        other signal with a python handler (SIGTERM, SIGINT, SIGQUIT, SIGHUP)
+        writes to the pipe as well. """
+    def __init__(self, signals):
+        self.signals = signals
+        self.handlers = {} # signum => previous handler
+        self.previous = -1 # previous wakeup fd
+        self.fd, self.wr = os.pipe()
+        for fd in [ self.fd, self.wr ]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        try:
+            self.previous = signal.set_wakeup_fd(self.wr) # main thread only
+        except ValueError:
+            self.close()
+            raise
+        for signum in self.signals:
+            self.handlers[signum] = signal.signal(signum, lambda signum, frame: None)
+            signal.siginterrupt(signum, False) # restart the other syscalls
+    def read(self):
+        """ clear the pipe (without waiting) """
+        while True:
+            try:
+                if not os.read(self.fd, 512):
+                    break
+            except OSError as e:
+                if e.errno in [ errno.EAGAIN, errno.EINTR ]:
+                    break
+                raise
+    def close(self):
+        if self.wr >= 0:
+            signal.set_wakeup_fd(self.previous)
+            for signum, handler in self.handlers.items():
+                signal.signal(signum, handler or signal.SIG_DFL)
+            self.handlers = {}
+            os.close(self.fd)
+            os.close(self.wr)
+            self.fd = self.wr = -1
+
+UnitName = collections.namedtuple("UnitName", ["name", "prefix", "instance", "suffix", "component" ])
+
 def parse_unit(name): # -> object(prefix, instance, suffix, ...., name, component)
     unit_name, suffix = name, ""
     has_suffix = name.rfind(".")
@@ -643,9 +1219,53 @@ def parse_unit(name): # -> object(prefix, instance, suffix, ...., name, componen
     has_component = prefix.rfind("-")
     if has_component > 0: 
         component = prefix[has_component+1:]
-    UnitName = collections.namedtuple("UnitName", ["name", "prefix", "instance", "suffix", "component" ])
     return UnitName(name, prefix, instance, suffix, component)
 
+class UnitNameMatcher:
+    """ the unit patterns of a command line compiled for a file glob on
+        the known unit names. A pattern without glob characters is taken
+        as the exact unit name or as the unit name without the suffix. """
+    def __init__(self, modules = None, suffix=".service"):
+        self.everything = not modules
+        self.names = {} # name => [ module-index,.. ]
+        self.globs = [] # [ (module-index, regex),.. ]
+        self.regex = None
+        patterns = []
+        flags = 0
+        for index, module in enumerate(modules or []):
+            self.names.setdefault(module + suffix, []).append(index)
+            if "*" not in module and "?" not in module and "[" not in module:
+                self.names.setdefault(module, []).append(index)
+                continue
+            pattern = fnmatch.translate(module)
+            if pattern.endswith("(?ms)"): # python2 style
+                pattern = pattern[:-len("(?ms)")]
+                flags = re.M | re.S
+            self.globs.append((index, re.compile(pattern, flags)))
+            patterns.append("(?:%s)" % pattern)
+        if patterns:
+            self.regex = re.compile("|".join(patterns), flags)
+    def match(self, name):
+        if self.everything or name in self.names:
+            return True
+        if self.regex is not None and self.regex.match(name):
+            return True
+        return False
+    def matching(self, name): # -> [ module-index,.. ]
+        """ the modules matching a name (which was found by select) """
+        found = set(self.names.get(name, []))
+        for index, regex in self.globs:
+            if index not in found and regex.match(name):
+                found.add(index)
+        return sorted(found)
+    def select(self, sorted_names, known):
+        """ the matching names in the order of the sorted names """
+        if self.everything:
+            return list(sorted_names)
+        if self.regex is None:
+            return sorted([ name for name in self.names if name in known ])
+        return [ name for name in sorted_names if self.match(name) ]
+
 def time_to_seconds(text, maximum = None):
     if maximum is None:
         maximum = DefaultMaximumTimeout
@@ -692,98 +1312,326 @@ def seconds_to_time(seconds):
     else:
         return "%ss" % (secs)
 
+UnitDependencyStyles = [ "After", "Before", "Requires", "Wants", "Requisite",
+    "BindsTo", "PartOf", "PropagateReloadTo", "Conflicts" ]
+
+class UnitDependencies(object):
+    """ the dependency settings of a unit conf being split only once - for
+        each style the unit names are kept in declaration order (without
+        duplicates) along with a frozenset for the membership checks. """
+    __slots__ = ["_names", "_sets"]
+    def __init__(self, conf):
+        self._names = {}
+        self._sets = {}
+        for style in UnitDependencyStyles:
+            names = []
+            seen = set()
+            for values in conf.getlist("Unit", style, []):
+                for name in values.split():
+                    if name not in seen:
+                        seen.add(name)
+                        names.append(intern(name))
+            self._names[style] = tuple(names)
+            self._sets[style] = frozenset(seen)
+    def names(self, style): # -> ( unit,.. )
+        return self._names.get(style, ())
+    def has(self, style, name):
+        return name in self._sets.get(style, ())
+    def nameset(self, style): # -> frozenset
+        return self._sets.get(style, frozenset())
+
 def getBefore(conf):
-    result = []
-    beforelist = conf.getlist("Unit", "Before", [])
-    for befores in beforelist:
-        for before in befores.split(" "):
-            name = before.strip()
-            if name and name not in result:
-                result.append(name)
-    return result
+    return list(conf.dependencies().names("Before"))
 
 def getAfter(conf):
-    result = []
-    afterlist = conf.getlist("Unit", "After", [])
-    for afters in afterlist:
-        for after in afters.split(" "):
-            name = after.strip()
-            if name and name not in result:
-                result.append(name)
-    return result
+    return list(conf.dependencies().names("After"))
 
 def compareAfter(confA, confB):
     idA = confA.name()
     idB = confB.name()
-    for after in getAfter(confA):
-        if after == idB:
-            logg.debug("%s After %s", idA, idB)
-            return -1
-    for after in getAfter(confB):
-        if after == idA:
-            logg.debug("%s After %s", idB, idA)
-            return 1
-    for before in getBefore(confA):
-        if before == idB:
-            logg.debug("%s Before %s", idA, idB)
-            return 1
-    for before in getBefore(confB):
-        if before == idA:
-            logg.debug("%s Before %s", idB, idA)
-            return -1
+    depsA = confA.dependencies()
+    depsB = confB.dependencies()
+    if depsA.has("After", idB):
+        logg.debug("%s After %s", idA, idB)
+        return -1
+    if depsB.has("After", idA):
+        logg.debug("%s After %s", idB, idA)
+        return 1
+    if depsA.has("Before", idB):
+        logg.debug("%s Before %s", idA, idB)
+        return 1
+    if depsB.has("Before", idA):
+        logg.debug("%s Before %s", idB, idA)
+        return -1
     return 0
 
-def sortedAfter(conflist, cmp = compareAfter):
-    # the normal sorted() does only look at two items
-    # so if "A after C" and a list [A, B, C] then
-    # it will see "A = B" and "B = C" assuming that
-    # "A = C" and the list is already sorted.
-    #
-    # To make a totalsorted we have to create a marker
-    # that informs sorted() that also B has a relation.
-    # It only works when 'after' has a direction, so
-    # anything without 'before' is a 'after'. In that
-    # case we find that "B after C".
-    class SortTuple:
-        def __init__(self, rank, conf):
-            self.rank = rank
-            self.conf = conf
-    sortlist = [ SortTuple(0, conf) for conf in conflist]
-    for check in xrange(len(sortlist)): # maxrank = len(sortlist)
-        changed = 0
-        for A in xrange(len(sortlist)):
-            for B in xrange(len(sortlist)):
-                if A != B:
-                    itemA = sortlist[A]
-                    itemB = sortlist[B]
-                    before = compareAfter(itemA.conf, itemB.conf)
-                    if before > 0 and itemA.rank <= itemB.rank:
-                        if DEBUG_AFTER: # pragma: no cover
-                            logg.info("  %-30s before %s", itemA.conf.name(), itemB.conf.name())
-                        itemA.rank = itemB.rank + 1
-                        changed += 1
-                    if before < 0 and itemB.rank <= itemA.rank:
-                        if DEBUG_AFTER: # pragma: no cover
-                            logg.info("  %-30s before %s", itemB.conf.name(), itemA.conf.name())
-                        itemB.rank = itemA.rank + 1
-                        changed += 1
-        if not changed:
-            if DEBUG_AFTER: # pragma: no cover
-                logg.info("done in check %s of %s", check, len(sortlist))
-            break
-            # because Requires is almost always the same as the After clauses
-            # we are mostly done in round 1 as the list is in required order
-    for conf in conflist:
-        if DEBUG_AFTER: # pragma: no cover
-            logg.debug(".. %s", conf.name())
-    for item in sortlist:
+class UnitOrdering:
+    """ The After=/Before= relations of a list of units as a graph where an
+        edge (A, B) says "A before B". The units are ranked by the longest
+        chain of units that need to come after them - that is the ranking
+        that the pairwise compareAfter checks had converged to. A cycle in
+        the relations is reported and its units are ranked together. The
+        'after' map adds After= relations by name (as for stop propagation). """
+    def __init__(self, conflist, after = None):
+        self.confs = list(conflist)
+        self.names = [ conf.name() for conf in self.confs ]
+        self.edges = [ set() for conf in self.confs ] # index => successor indexes
+        self._cycles = None
+        self._ranks = None
+        self._component = None
+        deps = [ conf.dependencies() for conf in self.confs ]
+        afters = [ dep.nameset("After") for dep in deps ]
+        if after:
+            afters = [ names | after.get(name, set()) for name, names in zip(self.names, afters) ]
+        befores = [ dep.nameset("Before") for dep in deps ]
+        indexes = {}
+        for index, name in enumerate(self.names):
+            indexes.setdefault(name, []).append(index)
+        def compare(A, B): # same as compareAfter
+            if self.names[B] in afters[A]: return -1
+            if self.names[A] in afters[B]: return 1
+            if self.names[B] in befores[A]: return 1
+            if self.names[A] in befores[B]: return -1
+            return 0
+        for A in xrange(len(self.confs)):
+            for name in afters[A] | befores[A]:
+                for B in indexes.get(name, []):
+                    if A == B:
+                        continue
+                    for X, Y in [ (A, B), (B, A) ]:
+                        before = compare(X, Y)
+                        if before > 0:
+                            self.edges[X].add(Y)
+                        if before < 0:
+                            self.edges[Y].add(X)
+    def components(self): # -> [ [ index,.. ],.. ]
+        """ strongly connected components (Tarjan) - successors come first """
+        count = len(self.confs)
+        order = [ None ] * count
+        lowlink = [ 0 ] * count
+        onstack = [ False ] * count
+        stack = []
+        components = []
+        counter = 0
+        for root in xrange(count):
+            if order[root] is not None:
+                continue
+            work = [ (root, iter(sorted(self.edges[root]))) ]
+            order[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onstack[root] = True
+            while work:
+                node, successors = work[-1]
+                descended = False
+                for succ in successors:
+                    if order[succ] is None:
+                        order[succ] = lowlink[succ] = counter
+                        counter += 1
+                        stack.append(succ)
+                        onstack[succ] = True
+                        work.append((succ, iter(sorted(self.edges[succ]))))
+                        descended = True
+                        break
+                    if onstack[succ]:
+                        lowlink[node] = min(lowlink[node], order[succ])
+                if descended:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == order[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onstack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+        return components
+    def ranks(self): # -> [ rank,.. ]
+        if self._ranks is None:
+            self._ranks = [ 0 ] * len(self.confs)
+            self._cycles = []
+            self._component = component_of = {}
+            for component in self.components():
+                rank = 0
+                for member in component:
+                    component_of[member] = component[0]
+                for member in component:
+                    for succ in self.edges[member]:
+                        if component_of.get(succ) != component[0]:
+                            rank = max(rank, self._ranks[succ] + 1)
+                for member in component:
+                    self._ranks[member] = rank
+                if len(component) > 1:
+                    self._cycles.append([ self.names[member] for member in component ])
+            for cycle in self._cycles:
+                logg.warning("found ordering cycle on %s", ", ".join(cycle))
+        return self._ranks
+    def predecessors(self, reverse = False): # -> [ set(index),.. ]
+        """ the units to be done before each unit (or after it for a reverse
+            order) - the edges within an ordering cycle are dropped so that
+            its units can not block each other """
+        self.ranks()
+        result = [ set() for conf in self.confs ]
+        for index, successors in enumerate(self.edges):
+            for succ in successors:
+                if self._component[index] != self._component[succ]:
+                    if reverse:
+                        result[index].add(succ)
+                    else:
+                        result[succ].add(index)
+        return result
+    def cycles(self): # -> [ [ names,.. ],.. ]
+        self.ranks()
+        return self._cycles
+    def sorted(self): # -> [ conf,.. ]
+        """ the confs by rank, otherwise in the given order """
+        ranks = self.ranks()
         if DEBUG_AFTER: # pragma: no cover
-            logg.info("(%s) %s", item.rank, item.conf.name())
-    sortedlist = sorted(sortlist, key = lambda item: -item.rank)
-    for item in sortedlist:
+            for index, conf in enumerate(self.confs):
+                logg.info("(%s) %s", ranks[index], conf.name())
+        sortedlist = sorted(xrange(len(self.confs)), key = lambda index: -ranks[index])
         if DEBUG_AFTER: # pragma: no cover
-            logg.info("[%s] %s", item.rank, item.conf.name())
-    return [ item.conf for item in sortedlist ]
+            for index in sortedlist:
+                logg.info("[%s] %s", ranks[index], self.confs[index].name())
+        return [ self.confs[index] for index in sortedlist ]
+
+def sortedAfter(conflist, cmp = compareAfter):
+    """ the start order of the units (see UnitOrdering) - the units with the
+        longest chain of units to be started after them come first """
+    return UnitOrdering(conflist).sorted()
+
+class UnitDependencyGraph:
+    """ The dependencies of the units for list-dependencies - each unit is
+        looked up only once per command. The rendered subtree of a unit is
+        reused as long as the units being skipped in it are the same (that
+        are the units shown on the levels above that it can reach). With a
+        forward graph given it is the graph of the reverse dependencies. """
+    def __init__(self, systemctl, forward = None):
+        self.systemctl = systemctl
+        self.show_all = systemctl._show_all
+        self.forward = forward
+        self._deps = {} # unit => { dep : style }
+        self._loaded = {}
+        self._reach = {}
+        self._subtree = {}
+        self._reverse = None # unit => { dependent : [ style,.. ] }
+        self._reversed = None
+    def deps(self, unit): # -> { dep : style }
+        if unit not in self._deps:
+            if self.forward is not None:
+                deps = ordered_dict()
+                for dependent, styles in self.forward.reverse_deps(unit).items():
+                    deps[dependent] = styles[0]
+                self._deps[unit] = deps
+                self._loaded[unit] = self.forward.loaded(unit)
+            else:
+                self._deps[unit] = self.systemctl.get_dependencies_unit(unit)
+                self._loaded[unit] = bool(self.systemctl.get_unit_conf(unit).loaded())
+        return self._deps[unit]
+    def reverse_deps(self, unit): # -> { dependent : [ style,.. ] }
+        """ the units that have a dependency on the unit - the reverse index
+            is made in one pass over all units (and their .wants folders) """
+        if self._reverse is None:
+            systemctl = self.systemctl
+            reverse = {}
+            def add(dep, dependent, style):
+                found = reverse.setdefault(dep, ordered_dict()).setdefault(dependent, [])
+                if style not in found:
+                    found.append(style)
+            units = systemctl.match_units()
+            systemctl.load_unit_confs(units)
+            for dependent in units:
+                deps = systemctl.get_unit_conf(dependent).dependencies()
+                for style in UnitDependencyStyles:
+                    if style in [ "After", "Before" ]:
+                        continue
+                    for dep in deps.names(style):
+                        add(dep, dependent, style)
+            for folder in sorted(systemctl._wants_files):
+                name = os.path.basename(folder)
+                dependent, style = os.path.splitext(name)
+                for dep in systemctl._wants_files[folder]:
+                    add(dep, dependent, style)
+            self._reverse = reverse
+        return self._reverse.get(unit, {})
+    def reversed(self):
+        if self._reversed is None:
+            self._reversed = UnitDependencyGraph(self.systemctl, self)
+        return self._reversed
+    def loaded(self, unit):
+        self.deps(unit)
+        return self._loaded[unit]
+    def reach(self, unit): # -> frozenset
+        """ the units below a unit that may be expanded in its subtree """
+        if unit not in self._reach:
+            found = set()
+            todo = list(self.deps(unit))
+            while todo:
+                dep = todo.pop()
+                if dep not in found:
+                    found.add(dep)
+                    if self.loaded(dep):
+                        todo.extend(self.deps(dep))
+            self._reach[unit] = frozenset(found)
+        return self._reach[unit]
+    def subtree(self, unit, mark, loop): # -> [ line,.. ]
+        """ the lines below a unit (relative to its indent) where the units
+            in the loop set are skipped as they were shown already """
+        for stop_recursion in [ "Conflict", "conflict", "reloaded", "Propagate" ]:
+            if stop_recursion in mark:
+                return []
+        key = (unit, loop & self.reach(unit))
+        if key in self._subtree:
+            return self._subtree[key]
+        mapping = {}
+        mapping["Requires"] = "required to start"
+        mapping["Wants"] = "wanted to start"
+        mapping["Requisite"] = "required started"
+        mapping["Bindsto"] = "binds to start"
+        mapping["PartOf"] = "part of started"
+        mapping[".requires"] = ".required to start"
+        mapping[".wants"] = ".wanted to start"
+        mapping["PropagateReloadTo"] = "(to be reloaded as well)"
+        mapping["Conflicts"] = "(to be stopped on conflict)"
+        if self.forward is not None:
+            mapping["Requires"] = "required by"
+            mapping["Wants"] = "wanted by"
+            mapping["Requisite"] = "requisite of"
+            mapping["BindsTo"] = "bound by"
+            mapping["PartOf"] = "consists of"
+            mapping[".requires"] = ".required by"
+            mapping[".wants"] = ".wanted by"
+            mapping["PropagateReloadTo"] = "(reloaded from)"
+            mapping["Conflicts"] = "(conflicted by)"
+        restrict = ["Requires", "Requisite", "ConsistsOf", "Wants", 
+            "BindsTo", ".requires", ".wants"]
+        if self.forward is not None:
+            restrict.append("PartOf") # reversed it is ConsistsOf
+        deps = self.deps(unit)
+        new_loop = loop | frozenset(deps)
+        lines = []
+        for dep, style in deps.items():
+            if dep in loop:
+                logg.debug("detected loop at %s", dep)
+                continue
+            if not self.show_all:
+                if style not in restrict:
+                    continue
+            new_mark = mapping.get(style, style)
+            if not self.loaded(dep):
+                if self.show_all:
+                    lines.append("| (%s): %s" % (dep, new_mark))
+                continue
+            lines.append("| %s: %s" % (dep, new_mark))
+            for line in self.subtree(dep, new_mark, new_loop):
+                lines.append("| " + line)
+        self._subtree[key] = lines
+        return lines
 
 class Systemctl:
     def __init__(self):
@@ -792,6 +1640,7 @@ class Systemctl:
         self._force = _force
         self._full = _full
         self._init = _init
+        self._job_mode = _job_mode
         self._no_ask_password = _no_ask_password
         self._no_legend = _no_legend
         self._now = _now
@@ -799,6 +1648,8 @@ class Systemctl:
         self._quiet = _quiet
         self._root = _root
         self._show_all = _show_all
+        self._reverse = _reverse
+        self._output = _output
         self._unit_property = _unit_property
         self._unit_state = _unit_state
         self._unit_type = _unit_type
@@ -811,6 +1662,22 @@ class Systemctl:
         self._loaded_file_sysd = {} # /etc/systemd/system/name.service => config data
         self._file_for_unit_sysv = None # name.service => /etc/init.d/name
         self._file_for_unit_sysd = None # name.service => /etc/systemd/system/name.service
+        self._drop_in_files = None # name.service => { extra.conf: /etc/systemd/system/name.service.d/extra.conf }
+        self._wants_files = None # /etc/systemd/system/multi-user.target.wants => [ name.service,.. ]
+        self._unit_index = None # see make_unit_index
+        self._unit_watch = None # init-loop
+        self._child_wakeup = None # init-loop
+        self._log_watch = None # init-loop
+        self._unit_reload = False # init-loop
+        self._dependency_graph = None
+        self._procs = ProcSnapshot() # status queries scan /proc once
+        self._interrupted = None # time of the SIGTERM/SIGINT to the init-loop
+        self._sorted_units_sysd = None
+        self._sorted_units_sysv = None
+        self._template_units = None # prefix => [ UnitName(prefix@.service),... ]
+        self._unit_cache = None # /etc/systemd/system/name.service => parsed sections
+        self._check_cache = None # /etc/systemd/system/name.service => syntax check
+        self._unit_cache_changed = False
         self._preset_file_list = None # /etc/systemd/system-preset/* => file content
         self._default_target = _default_target
         self._sysinit_target = None
@@ -862,43 +1729,149 @@ class Systemctl:
         if True:
             for folder in self.system_folders():
                 yield folder
-    def scan_unit_sysd_files(self, module = None): # -> [ unit-names,... ]
-        """ reads all unit files, returns the first filename for the unit given """
-        if self._file_for_unit_sysd is None:
-            self._file_for_unit_sysd = {}
-            for folder in self.sysd_folders():
-                if not folder: 
+    def cache_file(self, name):
+        """ the persistent caches are stored next to the lock files """
+        if not name:
+            return None
+        folder = _notify_socket_folder
+        if self.user_mode():
+            folder = _var_path(folder)
+        return os_path(self._root, os.path.join(folder, name))
+    def unit_index_file(self):
+        return self.cache_file(_unit_index_file)
+    def read_unit_index(self, sysd_folders, sysv_folders): # -> index?
+        """ the persistent unit index is valid as long as none of the
+            scanned folders has been modified (checked by their mtime) """
+        filename = self.unit_index_file()
+        index = marshal_load(filename, (UnitIndexVersion, sys.version_info[0]))
+        if index is None:
+            return None
+        if index.get("sysd_folders") != sysd_folders or index.get("sysv_folders") != sysv_folders:
+            return None
+        for folder, mtime in index["folders"]:
+            if os_folder_mtime(folder) != mtime:
+                logg.debug("unit index outdated by %s", folder)
+                return None
+        logg.debug("using unit index %s", filename)
+        return index
+    def write_unit_index(self, index):
+        """ the unit index is not written when a folder is too fresh
+            to tell a later modification by its mtime """
+        filename = self.unit_index_file()
+        if not filename:
+            return False
+        racy = time.time() - UnitIndexRacy
+        for folder, mtime in index["folders"]:
+            if mtime is not None and mtime > racy:
+                logg.debug("unit index not written as %s is too recent", folder)
+                return False
+        return marshal_save(filename, index)
+    def make_unit_index(self, sysd_folders, sysv_folders): # -> index
+        """ list all unit folders (and init.d folders) - the first one wins,
+            the drop-in folders some.service.d are listed in the same pass
+            and so are the .wants/.requires folders (with their mtime) """
+        folders = []
+        file_for_unit_sysd = {}
+        drop_in_files = {}
+        wants_files = {}
+        for folder in sysd_folders:
+            mtime = os_folder_mtime(folder)
+            folders.append((folder, mtime))
+            if mtime is None:
+                continue
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                if os.path.isdir(path):
+                    if name.endswith(".wants") or name.endswith(".requires"):
+                        folders.append((path, os_folder_mtime(path)))
+                        wants_files[path] = os.listdir(path)
+                    if name.endswith(".d"):
+                        folders.append((path, os_folder_mtime(path)))
+                        found = drop_in_files.setdefault(name[:-2], {})
+                        for conf in os.listdir(path):
+                            if not conf.endswith(".conf"):
+                                continue
+                            conf_path = os.path.join(path, conf)
+                            if os.path.isdir(conf_path):
+                                continue
+                            if conf not in found:
+                                found[conf] = conf_path
                     continue
-                folder = os_path(self._root, folder)
-                if not os.path.isdir(folder):
+                service_name = name
+                if service_name not in file_for_unit_sysd:
+                    file_for_unit_sysd[service_name] = path
+        file_for_unit_sysv = {}
+        for folder in sysv_folders:
+            mtime = os_folder_mtime(folder)
+            folders.append((folder, mtime))
+            if mtime is None:
+                continue
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                if os.path.isdir(path):
                     continue
-                for name in os.listdir(folder):
-                    path = os.path.join(folder, name)
-                    if os.path.isdir(path):
-                        continue
-                    service_name = name
-                    if service_name not in self._file_for_unit_sysd:
-                        self._file_for_unit_sysd[service_name] = path
-            logg.debug("found %s sysd files", len(self._file_for_unit_sysd))
+                service_name = name + ".service" # simulate systemd
+                if service_name not in file_for_unit_sysv:
+                    file_for_unit_sysv[service_name] = path
+        index = {}
+        index["version"] = (UnitIndexVersion, sys.version_info[0])
+        index["sysd_folders"] = sysd_folders
+        index["sysv_folders"] = sysv_folders
+        index["folders"] = folders
+        index["sysd"] = file_for_unit_sysd
+        index["sysv"] = file_for_unit_sysv
+        index["drop_in"] = drop_in_files
+        index["wants"] = wants_files
+        return index
+    def scan_unit_files(self):
+        """ reads all unit files and init.d files - or the unit index 
+            that was saved by an earlier call when it is still valid """
+        if self._file_for_unit_sysd is not None and self._file_for_unit_sysv is not None:
+            return
+        sysd_folders = [ os_path(self._root, folder) for folder in self.sysd_folders() if folder ]
+        sysv_folders = [ os_path(self._root, folder) for folder in self.init_folders() if folder ]
+        index = self.read_unit_index(sysd_folders, sysv_folders)
+        if index is None:
+            index = self.make_unit_index(sysd_folders, sysv_folders)
+            self.write_unit_index(index)
+        self._unit_index = index
+        self._file_for_unit_sysd = index["sysd"]
+        self._file_for_unit_sysv = index["sysv"]
+        self._drop_in_files = index["drop_in"]
+        self._wants_files = index["wants"]
+        self._sorted_units_sysd = sorted(self._file_for_unit_sysd)
+        self._sorted_units_sysv = sorted(self._file_for_unit_sysv)
+        self._template_units = None
+        logg.debug("found %s sysd files", len(self._file_for_unit_sysd))
+        logg.debug("found %s sysv files", len(self._file_for_unit_sysv))
+    def wants_folder_entries(self, folder): # -> [ name,.. ]
+        """ the entries of a .wants/.requires folder (with the root prefix) -
+            taken from the unit index when it is in one of the unit folders """
+        self.scan_unit_files()
+        found = self._wants_files.get(folder)
+        if found is not None:
+            return found
+        if os.path.dirname(folder) in self._unit_index["sysd_folders"]:
+            return [] # does not exist
+        if os.path.isdir(folder):
+            return os.listdir(folder)
+        return []
+    def update_wants_folder(self, folder):
+        """ after a change of the symlinks in a .wants/.requires folder """
+        if self._wants_files is None:
+            return
+        if os.path.isdir(folder):
+            self._wants_files[folder] = os.listdir(folder)
+        else:
+            self._wants_files.pop(folder, None)
+        self._dependency_graph = None
+    def scan_unit_sysd_files(self, module = None): # -> [ unit-names,... ]
+        """ reads all unit files, returns the first filename for the unit given """
+        self.scan_unit_files()
         return list(self._file_for_unit_sysd.keys())
     def scan_unit_sysv_files(self, module = None): # -> [ unit-names,... ]
         """ reads all init.d files, returns the first filename when unit is a '.service' """
-        if self._file_for_unit_sysv is None:
-            self._file_for_unit_sysv = {}
-            for folder in self.init_folders():
-                if not folder: 
-                    continue
-                folder = os_path(self._root, folder)
-                if not os.path.isdir(folder):
-                    continue
-                for name in os.listdir(folder):
-                    path = os.path.join(folder, name)
-                    if os.path.isdir(path):
-                        continue
-                    service_name = name + ".service" # simulate systemd
-                    if service_name not in self._file_for_unit_sysv:
-                        self._file_for_unit_sysv[service_name] = path
-            logg.debug("found %s sysv files", len(self._file_for_unit_sysv))
+        self.scan_unit_files()
         return list(self._file_for_unit_sysv.keys())
     def unit_sysd_file(self, module = None): # -> filename?
         """ file path for the given module (systemd) """
@@ -954,25 +1927,9 @@ class Systemctl:
             return False
         return True
     def find_drop_in_files(self, unit):
-        """ search for some.service.d/extra.conf files """
-        result = {}
-        basename_d = unit + ".d"
-        for folder in self.sysd_folders():
-            if not folder: 
-                continue
-            folder = os_path(self._root, folder)
-            override_d = os_path(folder, basename_d)
-            if not os.path.isdir(override_d):
-                continue
-            for name in os.listdir(override_d):
-                path = os.path.join(override_d, name)
-                if os.path.isdir(path):
-                    continue
-                if not path.endswith(".conf"):
-                    continue
-                if name not in result:
-                    result[name] = path
-        return result
+        """ search for some.service.d/extra.conf files (in the unit index) """
+        self.scan_unit_files()
+        return dict(self._drop_in_files.get(unit, {}))
     def load_sysd_template_conf(self, module): # -> conf?
         """ read the unit template with a UnitConfParser (systemd) """
         if module and "@" in module:
@@ -980,6 +1937,87 @@ class Systemctl:
             service = "%s@.service" % unit.prefix
             return self.load_sysd_unit_conf(service)
         return None
+    def unit_cache_file(self):
+        return self.cache_file(_unit_cache_file)
+    def load_unit_cache(self): # -> { unit-file: (identity, drop-ins, sections) }
+        """ the parsed unit files of earlier calls (read once per process) """
+        if self._unit_cache is None:
+            self._unit_cache = {}
+            self._check_cache = {}
+            cache = marshal_load(self.unit_cache_file(), (UnitIndexVersion, sys.version_info[0]))
+            if cache is not None:
+                self._unit_cache = cache["units"]
+                self._check_cache = cache.get("checks", {})
+                logg.debug("found %s cached units", len(self._unit_cache))
+        return self._unit_cache
+    def load_check_cache(self): # -> { unit-file: (identity, check) }
+        self.load_unit_cache()
+        return self._check_cache
+    def save_unit_cache(self):
+        """ write back the unit cache if new unit files were parsed """
+        if not self._unit_cache_changed:
+            return False
+        filename = self.unit_cache_file()
+        if not filename:
+            return False
+        self.scan_unit_files()
+        known = set(self._file_for_unit_sysd.values())
+        units = {}
+        for path, entry in self._unit_cache.items():
+            if path in known:
+                units[path] = entry
+        checks = {}
+        for path, entry in self._check_cache.items():
+            if path in known:
+                checks[path] = entry
+        cache = { "version": (UnitIndexVersion, sys.version_info[0]), "units": units, "checks": checks }
+        self._unit_cache_changed = False
+        return marshal_save(filename, cache)
+    def read_unit_cache(self, data, path, drop_in_files): # -> bool(found)
+        """ the cached sections are valid if the unit file and its drop-in files
+            (and any .include file) have the same (inode, mtime, size) """
+        cache = self.load_unit_cache()
+        if path not in cache:
+            return False
+        identity, overrides, sections = cache[path]
+        if overrides != tuple([ drop_in_files[name] for name in sorted(drop_in_files) ]):
+            return False
+        for filename, ino, mtime, size in identity:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                return False
+            if st.st_ino != ino or st.st_mtime != mtime or st.st_size != size:
+                return False
+        data.load_sections(sections, [ item[0] for item in identity ])
+        return True
+    def file_identity(self, filenames): # -> ((filename, inode, mtime, size),...)?
+        """ None if a file is missing or too recent to tell a later change by its mtime """
+        racy = time.time() - UnitIndexRacy
+        identity = []
+        for filename in filenames:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                return None
+            if st.st_mtime > racy:
+                logg.debug("unit cache skips %s as it is too recent", filename)
+                return None
+            identity.append((filename, st.st_ino, st.st_mtime, st.st_size))
+        return tuple(identity)
+    def write_unit_cache(self, data, path, drop_in_files):
+        cache = self.load_unit_cache()
+        if not self.unit_cache_file():
+            return False
+        identity = self.file_identity(data.filenames())
+        if identity is None:
+            if cache.pop(path, None) is not None:
+                self._unit_cache_changed = True
+            return False
+        overrides = tuple([ drop_in_files[name] for name in sorted(drop_in_files) ])
+        cache[path] = (identity, overrides, data.dump_sections())
+        self._unit_cache_changed = True
+        return True
     def load_sysd_unit_conf(self, module): # -> conf?
         """ read the unit file with a UnitConfParser (systemd) """
         path = self.unit_sysd_file(module)
@@ -992,12 +2030,13 @@ class Systemctl:
         drop_in_files = {}
         data = UnitConfParser()
         if not masked:
-            data.read_sysd(path)
             drop_in_files = self.find_drop_in_files(os.path.basename(path))
-            # load in alphabetic order, irrespective of location
-            for name in sorted(drop_in_files):
-                path = drop_in_files[name]
+            if not self.read_unit_cache(data, path, drop_in_files):
                 data.read_sysd(path)
+                # load in alphabetic order, irrespective of location
+                for name in sorted(drop_in_files):
+                    data.read_sysd(drop_in_files[name])
+                self.write_unit_cache(data, path, drop_in_files)
         conf = SystemctlConf(data, module)
         conf.masked = masked
         conf.drop_in_files = drop_in_files
@@ -1031,6 +2070,49 @@ class Systemctl:
         except Exception as e:
             logg.warning("%s not loaded: %s", module, e)
         return None
+    def unit_conf_file(self, module): # -> filename?
+        """ the file that load_unit_conf would read for the module """
+        path = self.unit_sysd_file(module)
+        if path is not None: return path
+        if module and "@" in module:
+            unit = parse_unit(module)
+            path = self.unit_sysd_file("%s@.service" % unit.prefix)
+            if path is not None: return path
+        return self.unit_sysv_file(module)
+    def load_unit_confs(self, units):
+        """ load the unit files for a number of units using some threads
+            (LoadUnitThreads) - the loaded confs are the same as from
+            load_unit_conf for each unit in the given order. """
+        self.scan_unit_files()
+        self.load_unit_cache()
+        pending = collections.deque()
+        filenames = set()
+        for unit in units:
+            filename = self.unit_conf_file(unit)
+            if not filename or filename in filenames:
+                continue
+            filenames.add(filename)
+            if filename in self._loaded_file_sysd or filename in self._loaded_file_sysv:
+                continue
+            pending.append(unit)
+        numthreads = min(LoadUnitThreads, len(pending))
+        if numthreads <= 1:
+            for unit in pending:
+                self.load_unit_conf(unit)
+            return
+        logg.debug("loading %s unit files with %s threads", len(pending), numthreads)
+        def load_pending():
+            while True:
+                try:
+                    unit = pending.popleft()
+                except IndexError:
+                    break
+                self.load_unit_conf(unit)
+        threads = [ threading.Thread(target = load_pending) for _ in xrange(numthreads) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
     def default_unit_conf(self, module, description = None): # -> conf
         """ a unit conf that can be printed to the user where
             attributes are empty and loaded() is False """
@@ -1049,6 +2131,17 @@ class Systemctl:
         if conf is not None:
             return conf
         return self.default_unit_conf(module)
+    def sysd_template_units(self): # -> { prefix: [ UnitName,... ] }
+        """ the known unit names with an '@' indexed by their prefix """
+        if self._template_units is None:
+            self.scan_unit_sysd_files()
+            self._template_units = {}
+            for item in self._sorted_units_sysd:
+                if "@" not in item:
+                    continue
+                service_unit = parse_unit(item)
+                self._template_units.setdefault(service_unit.prefix, []).append(service_unit)
+        return self._template_units
     def match_sysd_templates(self, modules = None, suffix=".service"): # -> generate[ unit ]
         """ make a file glob on all known template units (systemd areas).
             It returns no modules (!!) if no modules pattern were given.
@@ -1056,59 +2149,103 @@ class Systemctl:
         modules = to_list(modules)
         if not modules:
             return
-        self.scan_unit_sysd_files()
-        for item in sorted(self._file_for_unit_sysd.keys()):
-            if "@" not in item:
+        instances = {}
+        for module in modules:
+            if "@" not in module:
                 continue
-            service_unit = parse_unit(item)
-            for module in modules:
-                if "@" not in module:
-                    continue
-                module_unit = parse_unit(module)
-                if service_unit.prefix == module_unit.prefix:
-                    yield "%s@%s.%s" % (service_unit.prefix, module_unit.instance, service_unit.suffix)
-    def match_sysd_units(self, modules = None, suffix=".service"): # -> generate[ unit ]
+            module_unit = parse_unit(module)
+            instances.setdefault(module_unit.prefix, []).append(module_unit)
+        if not instances:
+            return
+        templates = self.sysd_template_units()
+        service_units = []
+        for prefix in instances:
+            service_units += templates.get(prefix, [])
+        for service_unit in sorted(service_units, key = lambda unit: unit.name):
+            for module_unit in instances[service_unit.prefix]:
+                yield "%s@%s.%s" % (service_unit.prefix, module_unit.instance, service_unit.suffix)
+    def match_sysd_units(self, modules = None, suffix=".service"): # -> [ unit ]
         """ make a file glob on all known units (systemd areas).
             It returns all modules if no modules pattern were given.
             Also a single string as one module pattern may be given. """
-        modules = to_list(modules)
+        matcher = UnitNameMatcher(to_list(modules), suffix)
         self.scan_unit_sysd_files()
-        for item in sorted(self._file_for_unit_sysd.keys()):
-            if not modules:
-                yield item
-            elif [ module for module in modules if fnmatch.fnmatchcase(item, module) ]:
-                yield item
-            elif [ module for module in modules if module+suffix == item ]:
-                yield item
-    def match_sysv_units(self, modules = None, suffix=".service"): # -> generate[ unit ]
+        return matcher.select(self._sorted_units_sysd, self._file_for_unit_sysd)
+    def match_sysv_units(self, modules = None, suffix=".service"): # -> [ unit ]
         """ make a file glob on all known units (sysv areas).
             It returns all modules if no modules pattern were given.
             Also a single string as one module pattern may be given. """
-        modules = to_list(modules)
+        matcher = UnitNameMatcher(to_list(modules), suffix)
         self.scan_unit_sysv_files()
-        for item in sorted(self._file_for_unit_sysv.keys()):
-            if not modules:
-                yield item
-            elif [ module for module in modules if fnmatch.fnmatchcase(item, module) ]:
-                yield item
-            elif [ module for module in modules if module+suffix == item ]:
-                yield item
+        return matcher.select(self._sorted_units_sysv, self._file_for_unit_sysv)
     def match_units(self, modules = None, suffix=".service"): # -> [ units,.. ]
         """ Helper for about any command with multiple units which can
             actually be glob patterns on their respective unit name. 
             It returns all modules if no modules pattern were given.
             Also a single string as one module pattern may be given. """
-        found = []
-        for unit in self.match_sysd_units(modules, suffix):
-            if unit not in found:
-                found.append(unit)
+        modules = to_list(modules)
+        matcher = UnitNameMatcher(modules, suffix)
+        self.scan_unit_files()
+        found = matcher.select(self._sorted_units_sysd, self._file_for_unit_sysd)
+        seen = set(found)
         for unit in self.match_sysd_templates(modules, suffix):
-            if unit not in found:
+            if unit not in seen:
+                seen.add(unit)
                 found.append(unit)
-        for unit in self.match_sysv_units(modules, suffix):
-            if unit not in found:
+        for unit in matcher.select(self._sorted_units_sysv, self._file_for_unit_sysv):
+            if unit not in seen:
+                seen.add(unit)
                 found.append(unit)
         return found
+    def match_modules(self, modules, suffix=".service"): # -> [ (module, [ units,.. ]),.. ]
+        """ Helper for the commands on multiple units - all the module
+            arguments are resolved in one pass over the known units where
+            each module gets the same units as match_units([ module ]) """
+        modules = to_list(modules)
+        matched = [ [] for module in modules ]
+        seen = [ set() for module in modules ]
+        if not modules:
+            return []
+        matcher = UnitNameMatcher(modules, suffix)
+        self.scan_unit_files()
+        for unit in matcher.select(self._sorted_units_sysd, self._file_for_unit_sysd):
+            for index in matcher.matching(unit):
+                matched[index].append(unit)
+                seen[index].add(unit)
+        templates = None
+        for index, module in enumerate(modules):
+            if "@" not in module:
+                continue
+            if templates is None:
+                templates = self.sysd_template_units()
+            module_unit = parse_unit(module)
+            for service_unit in templates.get(module_unit.prefix, []):
+                unit = "%s@%s.%s" % (service_unit.prefix, module_unit.instance, service_unit.suffix)
+                if unit not in seen[index]:
+                    matched[index].append(unit)
+                    seen[index].add(unit)
+        for unit in matcher.select(self._sorted_units_sysv, self._file_for_unit_sysv):
+            for index in matcher.matching(unit):
+                if unit not in seen[index]:
+                    matched[index].append(unit)
+                    seen[index].add(unit)
+        return list(zip(modules, matched))
+    def resolve_modules(self, modules, suffix=".service"): # -> ([ units,.. ], [ missing,.. ])
+        """ the units for all module arguments (without duplicates) and
+            the module arguments that did not match any unit """
+        units = []
+        missing = []
+        seen = set()
+        for module, matched in self.match_modules(modules, suffix):
+            if not matched:
+                logg.error("Unit %s could not be found.", unit_of(module))
+                missing.append(module)
+                continue
+            for unit in matched:
+                if unit not in seen:
+                    seen.add(unit)
+                    units.append(unit)
+        return units, missing
     def list_service_unit_basics(self):
         """ show all the basic loading state of services """
         filename = self.unit_file() # scan all
@@ -1124,7 +2261,9 @@ class Systemctl:
         active = {}
         substate = {}
         description = {}
-        for unit in self.match_units(modules):
+        units = self.match_units(modules)
+        self.load_unit_confs(units)
+        for unit in units:
             result[unit] = "not-found"
             active[unit] = "inactive"
             substate[unit] = "dead"
@@ -1156,7 +2295,9 @@ class Systemctl:
         logg.debug("list service unit files for %s", modules)
         result = {}
         enabled = {}
-        for unit in self.match_units(modules):
+        units = self.match_units(modules)
+        self.load_unit_confs(units)
+        for unit in units:
             result[unit] = None
             enabled[unit] = ""
             try: 
@@ -1315,7 +2456,7 @@ class Systemctl:
             return False
         dirpath = os.path.dirname(os.path.abspath(status_file))
         if not os.path.isdir(dirpath):
-            os.makedirs(dirpath)
+            shutil_makedirs(dirpath)
         if conf.status is None:
             conf.status = self.read_status_from(conf)
         if True:
@@ -1407,17 +2548,10 @@ class Systemctl:
                 logg.warning("could not access %s: %s", proc, e)
         return self.get_boottime_oldest()
     def get_boottime_oldest(self):
-        # otherwise get the oldest entry in /proc
-        booted = time.time()
-        for name in os.listdir("/proc"):
-            proc = "/proc/%s/status" % name
-            try:
-                if os.path.exists(proc):
-                    ctime = os.path.getmtime(proc)
-                    if ctime < booted:
-                        booted = ctime 
-            except Exception as e: # pragma: nocover
-                logg.warning("could not access %s: %s", proc, e)
+        # otherwise get the start of the oldest process in /proc
+        booted = self._procs.started()
+        if booted is None or booted > time.time():
+            return time.time()
         return booted
     def get_filetime(self, filename):
         return os.path.getmtime(filename)
@@ -1643,7 +2777,7 @@ class Systemctl:
         log_file = self.path_journal_log(conf)
         log_folder = os.path.dirname(log_file)
         if not os.path.isdir(log_folder):
-            os.makedirs(log_folder)
+            shutil_makedirs(log_folder)
         return open(os.path.join(log_file), "a")
     def chdir_workingdir(self, conf):
         """ if specified then change the working directory """
@@ -1687,7 +2821,7 @@ class Systemctl:
             logg.info("new notify socketfile (%s) = %s", len(socketfile), socketfile)
         try:
             if not os.path.isdir(os.path.dirname(socketfile)):
-                os.makedirs(os.path.dirname(socketfile))
+                shutil_makedirs(os.path.dirname(socketfile))
             if os.path.exists(socketfile):
                 os.unlink(socketfile)
         except Exception as e:
@@ -1749,61 +2883,235 @@ class Systemctl:
         """ [UNIT]... -- start these units
         /// SPECIAL: with --now or --init it will
             run the init-loop and stop the units afterwards """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         init = self._now or self._init
-        return self.start_units(units, init) and found_all
-    def start_units(self, units, init = None):
-        """ fails if any unit does not start
+        wanted = []
+        units, failed = self.start_transaction_units(units, wanted)
+        if not init:
+            return self.start_units(units, init, wanted) and found_all and not failed
+        with InitProcess(self):
+            return self.start_units(units, init, wanted) and found_all and not failed
+    def start_units(self, units, init = None, wanted = None):
+        """ fails if any unit does not start - except for the 'wanted' ones
+            that were only pulled in by a Wants= dependency. A unit is not
+            started when a unit that it Requires= and is After= has failed.
         /// SPECIAL: may run the init-loop and 
             stop the named units afterwards """
         self.wait_system()
-        done = True
-        started_units = []
-        for unit in self.sortedAfter(units):
-            started_units.append(unit)
-            if not self.start_unit(unit):
-                done = False
+        started_units = self.sortedAfter(units)
+        optional = set([ index for index, unit in enumerate(started_units) if unit in (wanted or []) ])
+        if UnitJobs > 1 and len(started_units) > 1:
+            done = self.start_units_parallel(started_units, optional)
+        else:
+            confs = [ self.get_unit_conf(unit) for unit in started_units ]
+            needs = self.start_needs_units(started_units, UnitOrdering(confs).predecessors())
+            done = True
+            failed = set()
+            for index, unit in enumerate(started_units):
+                if needs[index] & failed:
+                    logg.error("Dependency failed for %s", unit)
+                elif self.start_unit(unit):
+                    continue
+                failed.add(index)
+                if index not in optional:
+                    done = False
         if init:
             logg.info("init-loop start")
             sig = self.init_loop_until_stop(started_units)
             logg.info("init-loop %s", sig)
-            for unit in reversed(started_units):
-                self.stop_unit(unit)
+            self.stop_units(started_units, shutdown = True, deadline = self.shutdown_deadline())
         return done
-    def start_unit(self, unit):
-        conf = self.load_unit_conf(unit)
-        if conf is None:
-            logg.debug("unit could not be loaded (%s)", unit)
-            logg.error("Unit %s could not be found.", unit)
-            return False
-        if self.not_user_conf(conf):
-            logg.error("Unit %s not for --user mode", unit)
+    def start_units_parallel(self, unitlist, optional = ()):
+        """ start each unit as soon as the units it is ordered After= are
+            done, running up to UnitJobs start jobs at the same time.
+            Each job is a forked worker doing the usual start_unit, so the
+            waitlock and the status file are the same as for a single start."""
+        confs = [ self.get_unit_conf(unit) for unit in unitlist ]
+        waiting = UnitOrdering(confs).predecessors()
+        needs = self.start_needs_units(unitlist, waiting)
+        done, pending, running = self.run_unit_jobs("start", unitlist, confs, waiting,
+            needs = needs, optional = optional)
+        return done
+    def start_needs_units(self, unitlist, waiting): # -> [ set(index),.. ]
+        """ the Requires=/BindsTo= units that each unit is also ordered After=
+            (in the waiting sets) - when one of them fails then the unit is
+            not started (skipped with --job-mode=ignore-dependencies) """
+        needs = [ set() for unit in unitlist ]
+        if self._job_mode in [ "ignore-dependencies" ]:
+            return needs
+        graph = self.dependency_graph()
+        indexes = dict([ (unit, index) for index, unit in enumerate(unitlist) ])
+        for index, unit in enumerate(unitlist):
+            deps = self.get_unit_conf(unit).dependencies()
+            required = list(deps.names("Requires")) + list(deps.names("BindsTo"))
+            required += [ dep_unit for dep_unit, style in graph.deps(unit).items() if style == ".requires" ]
+            for dep_unit in required:
+                if dep_unit in indexes and indexes[dep_unit] in waiting[index]:
+                    needs[index].add(indexes[dep_unit])
+        return needs
+    def run_unit_jobs(self, job, unitlist, confs, waiting, deadline = None, needs = None, optional = ()):
+        """ run the start/stop jobs for the units whose waiting set is empty,
+            and take the unit out of the other waiting sets when its job is
+            done. A unit whose 'needs' have failed is skipped as failed, and
+            a failure of an 'optional' unit does not fail the result.
+            Returns the pending units and running jobs at the deadline."""
+        func = getattr(self, job + "_unit")
+        pending = list(xrange(len(unitlist)))
+        running = {} # pid => index
+        failed = set()
+        done = True
+        while pending or running:
+            skipped = True
+            while needs and skipped:
+                skipped = False
+                for index in list(pending):
+                    if waiting[index] or not needs[index] & failed:
+                        continue
+                    pending.remove(index)
+                    logg.error("Dependency failed for %s", unitlist[index])
+                    failed.add(index)
+                    if index not in optional:
+                        done = False
+                    for waits in waiting:
+                        waits.discard(index)
+                    skipped = True
+            if not pending and not running:
+                break
+            for index in list(pending):
+                if len(running) >= UnitJobs:
+                    break
+                if waiting[index]:
+                    continue
+                pending.remove(index)
+                unit = unitlist[index]
+                logg.debug("%s job %s (%s running)", job, unit, len(running))
+                running[self.fork_unit_job(func, unit)] = index
+            if not running: # pragma: no cover
+                logg.error("no %s job can be run for %s", job,
+                    " ".join([ unitlist[index] for index in pending ]))
+                return False, pending, running
+            found = self.wait_unit_job(running, deadline)
+            if not found:
+                return False, pending, running
+            pid, returncode = found
+            index = running.pop(pid)
+            confs[index].status = None # written by the worker
+            if returncode:
+                failed.add(index)
+                if index not in optional:
+                    done = False
+            logg.debug("%s job %s done (%s)", job, unitlist[index], returncode or "OK")
+            for waits in waiting:
+                waits.discard(index)
+        return done, pending, running
+    def fork_unit_job(self, func, unit): # -> pid
+        """ run func(unit) in a worker process - its exitcode is 0 on success """
+        pid = os.fork()
+        if not pid: # pragma: no cover
+            returncode = 1
+            try:
+                if func(unit):
+                    returncode = 0
+            except BaseException as e:
+                logg.error("%s job failed: %s", unit, e)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(returncode)
+        self._procs.refresh()
+        return pid
+    def wait_unit_job(self, running, deadline = None): # -> (pid, returncode)?
+        """ wait for one of the running job workers to exit - other
+            children are reaped along the way (e.g. orphans on PID 1).
+            Returns None when the deadline has passed."""
+        while True:
+            try:
+                if deadline is None:
+                    pid, status = os.waitpid(-1, 0)
+                else:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                    if not pid:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return None
+                        time.sleep(min(remaining, EpsilonTime))
+                        continue
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD: # pragma: no cover
+                    return list(running.keys())[0], 1
+                raise
+            self._procs.refresh()
+            if pid in running:
+                if os.WIFEXITED(status):
+                    return pid, os.WEXITSTATUS(status)
+                return pid, 1
+    def start_unit(self, unit):
+        conf = self.load_unit_conf(unit)
+        if conf is None:
+            logg.debug("unit could not be loaded (%s)", unit)
+            logg.error("Unit %s could not be found.", unit)
+            return False
+        if self.not_user_conf(conf):
+            logg.error("Unit %s not for --user mode", unit)
             return False
         return self.start_unit_from(conf)
     def get_TimeoutStartSec(self, conf):
-        timeout = conf.get("Service", "TimeoutSec", DefaultTimeoutStartSec)
-        timeout = conf.get("Service", "TimeoutStartSec", timeout)
-        return time_to_seconds(timeout, DefaultMaximumTimeout)
+        def get_timeout():
+            timeout = conf.get("Service", "TimeoutSec", DefaultTimeoutStartSec)
+            timeout = conf.get("Service", "TimeoutStartSec", timeout)
+            return time_to_seconds(timeout, DefaultMaximumTimeout)
+        return conf.memo("TimeoutStartSec", get_timeout)
     def start_unit_from(self, conf):
         if not conf: return False
         if self.syntax_check(conf) > 100: return False
-        with waitlock(conf):
+        return self.unit_job_from(conf, "start")
+    def unit_job_from(self, conf, job):
+        """ run a start/stop/reload/restart job for the unit - or share the
+            result of the same job queued by another systemctl call """
+        queue = UnitJobQueue(conf)
+        submitted = queue.submit(job, self._job_mode)
+        if submitted is None:
+            return False
+        jobid, attached = submitted
+        if attached: # as long as a restart at most
+            timeout = self.get_TimeoutStopSec(conf) + self.get_TimeoutStartSec(conf)
+            return queue.wait(jobid, timeout)
+        done = False
+        try:
+            with waitlock(conf), self._procs.changing():
+                job = queue.begin(jobid)
+                if job is None:
+                    logg.info("job %s for %s was canceled", jobid, conf.name())
+                else:
+                    done = self.do_unit_job_from(conf, job)
+        finally:
+            queue.finish(jobid, done)
+        return done
+    def do_unit_job_from(self, conf, job):
+        if job == "start":
             logg.debug(" start unit %s => %s", conf.name(), conf.filename())
             return self.do_start_unit_from(conf)
+        if job == "stop":
+            logg.info(" stop unit %s => %s", conf.name(), conf.filename())
+            return self.do_stop_unit_from(conf)
+        if job == "reload":
+            logg.info(" reload unit %s => %s", conf.name(), conf.filename())
+            return self.do_reload_unit_from(conf)
+        if job == "restart":
+            logg.info(" restart unit %s => %s", conf.name(), conf.filename())
+            if not self.is_active_from(conf):
+                return self.do_start_unit_from(conf)
+            else:
+                return self.do_restart_unit_from(conf)
+        logg.error("unknown job %s for %s", job, conf.name())
+        return False
     def do_start_unit_from(self, conf):
         timeout = self.get_TimeoutStartSec(conf)
         doRemainAfterExit = conf.getbool("Service", "RemainAfterExit", "no")
-        runs = conf.get("Service", "Type", "simple").lower()
+        runs = self.get_Type(conf)
         env = self.get_env(conf)
         self.exec_check_service(conf, env, "Exec") # all...
         # for StopPost on failure:
@@ -2057,15 +3365,17 @@ class Systemctl:
                 if item:
                     result.append(self.expand_special(item, conf))
         return result
+    def get_Type(self, conf):
+        return conf.memo("Type", lambda: conf.get("Service", "Type", "simple").lower())
     def get_User(self, conf):
-        return self.expand_special(conf.get("Service", "User", ""), conf)
+        return conf.memo("User", lambda: self.expand_special(conf.get("Service", "User", ""), conf))
     def get_Group(self, conf):
-        return self.expand_special(conf.get("Service", "Group", ""), conf)
+        return conf.memo("Group", lambda: self.expand_special(conf.get("Service", "Group", ""), conf))
     def get_SupplementaryGroups(self, conf):
         return self.expand_list(conf.getlist("Service", "SupplementaryGroups", []), conf)
     def execve_from(self, conf, cmd, env):
         """ this code is commonly run in a child process // returns exit-code"""
-        runs = conf.get("Service", "Type", "simple").lower()
+        runs = self.get_Type(conf)
         logg.debug("%s process for %s", runs, conf.filename())
         inp = open("/dev/zero")
         out = self.open_journal_log(conf)
@@ -2101,26 +3411,76 @@ class Systemctl:
         return None
     def stop_modules(self, *modules):
         """ [UNIT]... -- stop these units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
-        return self.stop_units(units) and found_all
-    def stop_units(self, units):
-        """ fails if any unit fails to stop """
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
+        after = {} # the PartOf/BindsTo dependents are stopped first
+        units = self.propagate_units(units, "stop", after)
+        return self.stop_units(units, after = after) and found_all
+    def shutdown_deadline(self): # -> time
+        """ the TimeoutShutdownSec is counted from the SIGTERM to the init-loop
+            (as 'docker stop' sends a SIGKILL 10s after it) - the default of
+            9s leaves a second for the SIGKILL and reaping at the deadline. """
+        return (self._interrupted or time.time()) + DefaultTimeoutShutdownSec
+    def stop_units(self, units, shutdown = None, after = None, deadline = None):
+        """ fails if any unit fails to stop
+        /// SPECIAL: on a shutdown everything still alive
+            is killed at the deadline (after TimeoutShutdownSec) """
         self.wait_system()
+        stopped_units = self.sortedBefore(units, after)
+        if not shutdown:
+            deadline = None
+        elif deadline is None:
+            deadline = self.shutdown_deadline()
+        if (UnitJobs > 1 and len(stopped_units) > 1) or deadline:
+            return self.stop_units_parallel(stopped_units, deadline, after)
         done = True
-        for unit in self.sortedBefore(units):
+        for unit in stopped_units:
             if not self.stop_unit(unit):
                 done = False
         return done
+    def stop_units_parallel(self, unitlist, deadline = None, after = None):
+        """ stop each unit as soon as the units ordered After= it are down,
+            running up to UnitJobs stop jobs at the same time. At the
+            deadline the jobs and the main processes of the remaining units
+            are killed (including their children)."""
+        confs = [ self.get_unit_conf(unit) for unit in unitlist ]
+        mainpids = {} # index => (pid, starttime) before the stop jobs
+        for index, conf in enumerate(confs):
+            mainpid = to_int(self.read_mainpid_from(conf, ""))
+            found = mainpid and self._procs.get(mainpid)
+            if found:
+                mainpids[index] = (mainpid, found[2])
+        waiting = UnitOrdering(confs, after).predecessors(reverse = True)
+        done, pending, running = self.run_unit_jobs("stop", unitlist, confs, waiting, deadline)
+        if not pending and not running:
+            return done
+        remaining = pending + list(running.values())
+        logg.warning("shutdown timeout - killing %s", 
+            " ".join([ unitlist[index] for index in remaining ]))
+        self._procs.refresh()
+        pidlist = []
+        for pid in running:
+            pidlist += self.pidlist_of(pid)
+        for index in remaining:
+            confs[index].status = None # the stop job may have changed it
+            mainpid = to_int(self.read_mainpid_from(confs[index], ""))
+            if not mainpid and index in mainpids:
+                mainpid, starttime = mainpids[index] # status cleaned before the exit
+                found = self._procs.get(mainpid)
+                if not found or found[2] != starttime:
+                    continue # gone (or reused)
+            if mainpid and self._procs.alive(mainpid):
+                pidlist += self.pidlist_of(mainpid)
+        self.kill_pidlist(pidlist, signal.SIGKILL)
+        for pid in running:
+            try: os.waitpid(pid, 0)
+            except OSError as e:
+                logg.debug("waitpid %s: %s", pid, e)
+        self._procs.refresh()
+        for index in remaining:
+            confs[index].status = None
+            self.clean_status_from(confs[index])
+        return False
     def stop_unit(self, unit):
         conf = self.load_unit_conf(unit)
         if conf is None:
@@ -2132,18 +3492,18 @@ class Systemctl:
         return self.stop_unit_from(conf)
 
     def get_TimeoutStopSec(self, conf):
-        timeout = conf.get("Service", "TimeoutSec", DefaultTimeoutStartSec)
-        timeout = conf.get("Service", "TimeoutStopSec", timeout)
-        return time_to_seconds(timeout, DefaultMaximumTimeout)
+        def get_timeout():
+            timeout = conf.get("Service", "TimeoutSec", DefaultTimeoutStartSec)
+            timeout = conf.get("Service", "TimeoutStopSec", timeout)
+            return time_to_seconds(timeout, DefaultMaximumTimeout)
+        return conf.memo("TimeoutStopSec", get_timeout)
     def stop_unit_from(self, conf):
         if not conf: return False
         if self.syntax_check(conf) > 100: return False
-        with waitlock(conf):
-            logg.info(" stop unit %s => %s", conf.name(), conf.filename())
-            return self.do_stop_unit_from(conf)
+        return self.unit_job_from(conf, "stop")
     def do_stop_unit_from(self, conf):
         timeout = self.get_TimeoutStopSec(conf)
-        runs = conf.get("Service", "Type", "simple").lower()
+        runs = self.get_Type(conf)
         env = self.get_env(conf)
         self.exec_check_service(conf, env, "ExecStop")
         returncode = 0
@@ -2288,6 +3648,16 @@ class Systemctl:
         if not pid:
             return True
         logg.info("wait for PID %s to vanish (%ss)", pid, timeout)
+        pidfds = pidfds_of([ to_int(pid) ])
+        if pidfds is not None:
+            started = time.time()
+            remaining = pidfds_wait(pidfds, timeout)
+            pidfds_close(pidfds)
+            if not remaining:
+                logg.info("wait for PID %s is done (%.3fs)", pid, time.time() - started)
+                return True
+            logg.info("wait for PID %s failed (%ss)", pid, timeout)
+            return False
         for x in xrange(int(timeout)):
             if not self.is_active_pid(pid):
                 logg.info("wait for PID %s is done (%s.)", pid, x)
@@ -2298,17 +3668,8 @@ class Systemctl:
     def reload_modules(self, *modules):
         """ [UNIT]... -- reload these units """
         self.wait_system()
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.reload_units(units) and found_all
     def reload_units(self, units):
         """ fails if any unit fails to reload """
@@ -2330,11 +3691,9 @@ class Systemctl:
     def reload_unit_from(self, conf):
         if not conf: return False
         if self.syntax_check(conf) > 100: return False
-        with waitlock(conf):
-            logg.info(" reload unit %s => %s", conf.name(), conf.filename())
-            return self.do_reload_unit_from(conf)
+        return self.unit_job_from(conf, "reload")
     def do_reload_unit_from(self, conf):
-        runs = conf.get("Service", "Type", "simple").lower()
+        runs = self.get_Type(conf)
         env = self.get_env(conf)
         self.exec_check_service(conf, env, "ExecReload")
         if runs in [ "sysv" ]:
@@ -2383,18 +3742,13 @@ class Systemctl:
             return False
     def restart_modules(self, *modules):
         """ [UNIT]... -- restart these units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
-        return self.restart_units(units) and found_all
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
+        dependents = self.propagate_units(units, "restart")[len(units):]
+        done = self.restart_units(units)
+        if dependents:
+            done = self.try_restart_units(dependents) and done
+        return done and found_all
     def restart_units(self, units):
         """ fails if any unit fails to restart """
         self.wait_system()
@@ -2415,29 +3769,15 @@ class Systemctl:
     def restart_unit_from(self, conf):
         if not conf: return False
         if self.syntax_check(conf) > 100: return False
-        with waitlock(conf):
-            logg.info(" restart unit %s => %s", conf.name(), conf.filename())
-            if not self.is_active_from(conf):
-                return self.do_start_unit_from(conf)
-            else:
-                return self.do_restart_unit_from(conf)
+        return self.unit_job_from(conf, "restart")
     def do_restart_unit_from(self, conf):
         logg.info("(restart) => stop/start")
         self.do_stop_unit_from(conf)
         return self.do_start_unit_from(conf)
     def try_restart_modules(self, *modules):
         """ [UNIT]... -- try-restart these units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.try_restart_units(units) and found_all
     def try_restart_units(self, units):
         """ fails if any module fails to try-restart """
@@ -2456,24 +3796,15 @@ class Systemctl:
         if self.not_user_conf(conf):
             logg.error("Unit %s not for --user mode", unit)
             return False
-        with waitlock(conf):
+        with waitlock(conf), self._procs.changing():
             logg.info(" try-restart unit %s => %s", conf.name(), conf.filename())
             if self.is_active_from(conf):
                 return self.do_restart_unit_from(conf)
         return True
     def reload_or_restart_modules(self, *modules):
         """ [UNIT]... -- reload-or-restart these units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.reload_or_restart_units(units) and found_all
     def reload_or_restart_units(self, units):
         """ fails if any unit does not reload-or-restart """
@@ -2496,7 +3827,7 @@ class Systemctl:
     def reload_or_restart_unit_from(self, conf):
         """ do 'reload' if specified, otherwise do 'restart' """
         if not conf: return False
-        with waitlock(conf):
+        with waitlock(conf), self._procs.changing():
             logg.info(" reload-or-restart unit %s => %s", conf.name(), conf.filename())
             return self.do_reload_or_restart_unit_from(conf)
     def do_reload_or_restart_unit_from(self, conf):
@@ -2512,17 +3843,8 @@ class Systemctl:
             return self.do_restart_unit_from(conf)
     def reload_or_try_restart_modules(self, *modules):
         """ [UNIT]... -- reload-or-try-restart these units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.reload_or_try_restart_units(units) and found_all
     def reload_or_try_restart_units(self, units):
         """ fails if any unit fails to reload-or-try-restart """
@@ -2542,7 +3864,7 @@ class Systemctl:
             return False
         return self.reload_or_try_restart_unit_from(conf)
     def reload_or_try_restart_unit_from(self, conf):
-        with waitlock(conf):
+        with waitlock(conf), self._procs.changing():
             logg.info(" reload-or-try-restart unit %s => %s", conf.name(), conf.filename())
             return self.do_reload_or_try_restart_unit_from(conf)
     def do_reload_or_try_restart_unit_from(self, conf):
@@ -2554,17 +3876,8 @@ class Systemctl:
             return self.do_restart_unit_from(conf)
     def kill_modules(self, *modules):
         """ [UNIT]... -- kill these units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.kill_units(units) and found_all
     def kill_units(self, units):
         """ fails if any unit could not be killed """
@@ -2585,7 +3898,7 @@ class Systemctl:
         return self.kill_unit_from(conf)
     def kill_unit_from(self, conf):
         if not conf: return False
-        with waitlock(conf):
+        with waitlock(conf), self._procs.changing():
             logg.info(" kill unit %s => %s", conf.name(), conf.filename())
             return self.do_kill_unit_from(conf)
     def do_kill_unit_from(self, conf):
@@ -2613,53 +3926,88 @@ class Systemctl:
             # because we list child processes, not processes in control-group
             return True
         pidlist = self.pidlist_of(mainpid) # here
-        if pid_exists(mainpid):
-            logg.info("stop kill PID %s", mainpid)
-            self._kill_pid(mainpid, kill_signal)
-        if useKillMode in ["control-group"]:
-            if len(pidlist) > 1:
-                logg.info("stop control-group PIDs %s", pidlist)
-            for pid in pidlist:
-                if pid != mainpid:
-                    self._kill_pid(pid, kill_signal)
-        if doSendSIGHUP: 
-            logg.info("stop SendSIGHUP to PIDs %s", pidlist)
-            for pid in pidlist:
-                self._kill_pid(pid, signal.SIGHUP)
-        # wait for the processes to have exited
-        while True:
-            dead = True
-            for pid in pidlist:
-                if pid_exists(pid) and not pid_zombie(pid):
-                    dead = False
+        pidfds = pidfds_of(pidlist) # before any signal - no pid reuse
+        try:
+            if pid_exists(mainpid):
+                logg.info("stop kill PID %s", mainpid)
+                self._kill_pid(mainpid, kill_signal, pidfds)
+            if useKillMode in ["control-group"]:
+                if len(pidlist) > 1:
+                    logg.info("stop control-group PIDs %s", pidlist)
+                for pid in pidlist:
+                    if pid != mainpid:
+                        self._kill_pid(pid, kill_signal, pidfds)
+            if doSendSIGHUP: 
+                logg.info("stop SendSIGHUP to PIDs %s", pidlist)
+                for pid in pidlist:
+                    self._kill_pid(pid, signal.SIGHUP, pidfds)
+            # wait for the processes to have exited
+            if pidfds is not None:
+                dead = not pidfds_wait(pidfds, started + timeout - time.time())
+                if not dead:
+                    logg.info("service PIDs not stopped after %s", timeout)
+            while pidfds is None:
+                dead = True
+                for pid in pidlist:
+                    if pid_exists(pid) and not pid_zombie(pid):
+                        dead = False
+                        break
+                if dead:
                     break
-            if dead:
-                break
-            if time.time() > started + timeout:
-                logg.info("service PIDs not stopped after %s", timeout)
-                break
-            time.sleep(1) # until TimeoutStopSec
-        if dead or not doSendSIGKILL:
-            logg.info("done kill PID %s %s", mainpid, dead and "OK")
+                if time.time() > started + timeout:
+                    logg.info("service PIDs not stopped after %s", timeout)
+                    break
+                time.sleep(1) # until TimeoutStopSec
+            if dead or not doSendSIGKILL:
+                logg.info("done kill PID %s %s", mainpid, dead and "OK")
+                return dead
+            if useKillMode in [ "control-group", "mixed" ]:
+                logg.info("hard kill PIDs %s", pidlist)
+                for pid in pidlist:
+                    if pid != mainpid:
+                        self._kill_pid(pid, signal.SIGKILL, pidfds)
+                time.sleep(MinimumYield)
+            # useKillMode in [ "control-group", "mixed", "process" ]
+            if pid_exists(mainpid):
+                logg.info("hard kill PID %s", mainpid)
+                self._kill_pid(mainpid, signal.SIGKILL, pidfds)
+                time.sleep(MinimumYield)
+            dead = not pid_exists(mainpid) or pid_zombie(mainpid)
+            logg.info("done hard kill PID %s %s", mainpid, dead and "OK")
             return dead
-        if useKillMode in [ "control-group", "mixed" ]:
-            logg.info("hard kill PIDs %s", pidlist)
+        finally:
+            if pidfds is not None:
+                pidfds_close(pidfds)
+    def kill_pidlist(self, pidlist, kill_signal = None):
+        """ kill the processes found in the /proc snapshot - a pid that has
+            been reused since (another starttime) is left alone, and with
+            the pidfds_of the processes it can not be reused before the kill """
+        starttimes = {}
+        for pid in pidlist:
+            found = self._procs.get(pid)
+            starttimes[pid] = found and found[2]
+        pidfds = pidfds_of(pidlist)
+        try:
             for pid in pidlist:
-                if pid != mainpid:
-                    self._kill_pid(pid, signal.SIGKILL)
-            time.sleep(MinimumYield)
-        # useKillMode in [ "control-group", "mixed", "process" ]
-        if pid_exists(mainpid):
-            logg.info("hard kill PID %s", mainpid)
-            self._kill_pid(mainpid, signal.SIGKILL)
-            time.sleep(MinimumYield)
-        dead = not pid_exists(mainpid) or pid_zombie(mainpid)
-        logg.info("done hard kill PID %s %s", mainpid, dead and "OK")
-        return dead
-    def _kill_pid(self, pid, kill_signal = None):
+                found = self._procs.read(pid)
+                if not found or found[2] != starttimes[pid]:
+                    logg.debug("kill PID %s => gone (or reused)", pid)
+                    continue
+                self._kill_pid(pid, kill_signal, pidfds)
+        finally:
+            if pidfds is not None:
+                pidfds_close(pidfds)
+    def _kill_pid(self, pid, kill_signal = None, pidfds = None):
+        """ with the pidfds_of the processes a reused pid is not hit """
         try: 
             sig = kill_signal or signal.SIGTERM
-            os.kill(pid, sig)
+            if pidfds is None:
+                os.kill(pid, sig)
+            elif pid in pidfds:
+                signal.pidfd_send_signal(pidfds[pid], sig)
+            else:
+                raise OSError(errno.ESRCH, "gone before pidfd_open")
+            self._procs.refresh()
         except OSError as e:
             if e.errno == errno.ESRCH or e.errno == errno.ENOENT:
                 logg.debug("kill PID %s => No such process", pid)
@@ -2684,8 +4032,7 @@ class Systemctl:
         #   and "Unless --quiet is specified, print the unit state"
         units = []
         results = []
-        for module in modules:
-            units = self.match_units([ module ])
+        for module, units in self.match_modules(modules):
             if not units:
                 logg.error("Unit %s could not be found.", unit_of(module))
                 results += [ "unknown" ]
@@ -2714,7 +4061,9 @@ class Systemctl:
     def active_pid_from(self, conf):
         if not conf: return False
         pid = self.read_mainpid_from(conf, "")
-        return self.is_active_pid(pid)
+        if pid and self._procs.alive(pid):
+            return pid
+        return None
     def is_active_pid(self, pid):
         """ returns pid if the pid is still an active process """
         if pid and pid_exists(pid) and not pid_zombie(pid):
@@ -2745,7 +4094,7 @@ class Systemctl:
         pid = self.read_mainpid_from(conf, "")
         logg.debug("pid_file '%s' => PID %s", pid_file or status_file, pid)
         if pid:
-            if not pid_exists(pid) or pid_zombie(pid):
+            if not self._procs.alive(pid):
                 return "failed"
             return "active"
         else:
@@ -2768,7 +4117,7 @@ class Systemctl:
         pid = self.read_mainpid_from(conf, "")
         logg.debug("pid_file '%s' => PID %s", pid_file or status_file, pid)
         if pid:
-            if not pid_exists(pid) or pid_zombie(pid):
+            if not self._procs.alive(pid):
                 return "failed"
             return "running"
         else:
@@ -2778,8 +4127,7 @@ class Systemctl:
         implements True if any is-active = True """
         units = []
         results = []
-        for module in modules:
-            units = self.match_units([ module ])
+        for module, units in self.match_modules(modules):
             if not units:
                 logg.error("Unit %s could not be found.", unit_of(module))
                 results += [ "unknown" ]
@@ -2802,8 +4150,7 @@ class Systemctl:
         """ [UNIT]... -- Reset failed state for all, one, or more units """
         units = []
         status = True
-        for module in modules:
-            units = self.match_units([ module ])
+        for module, units in self.match_modules(modules):
             if not units:
                 logg.error("Unit %s could not be found.", unit_of(module))
                 return 1
@@ -2846,17 +4193,8 @@ class Systemctl:
     def status_modules(self, *modules):
         """ [UNIT]... check the status of these units.
         """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         status, result = self.status_units(units)
         if not found_all:
             status = 3 # same as (dead) # original behaviour
@@ -2894,17 +4232,8 @@ class Systemctl:
     def cat_modules(self, *modules):
         """ [UNIT]... show the *.system file for these"
         """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         done, result = self.cat_units(units)
         return (done and found_all, result)
     def cat_units(self, units):
@@ -2968,17 +4297,8 @@ class Systemctl:
         if self.user_mode():
             logg.warning("preset makes no sense in --user mode")
             return True
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.preset_units(units) and found_all
     def preset_units(self, units):
         """ fails if any unit could not be changed """
@@ -3011,6 +4331,7 @@ class Systemctl:
             return True
         found_all = True
         units = self.match_units() # TODO: how to handle module arguments
+        self.load_unit_confs(units)
         return self.preset_units(units) and found_all
     def wanted_from(self, conf, default = None):
         if not conf: return default
@@ -3039,8 +4360,7 @@ class Systemctl:
         """ [UNIT]... -- enable these units """
         found_all = True
         units = []
-        for module in modules:
-            matched = self.match_units([ module ])
+        for module, matched in self.match_modules(modules):
             if not matched:
                 logg.error("Unit %s could not be found.", unit_of(module))
                 found_all = False
@@ -3089,6 +4409,7 @@ class Systemctl:
             os.remove(target)
         if not os.path.islink(target):
             os.symlink(unit_file, target)
+        self.update_wants_folder(folder)
         return True
     def rc3_root_folder(self):
         old_folder = "/etc/rc3.d"
@@ -3136,17 +4457,8 @@ class Systemctl:
         return True
     def disable_modules(self, *modules):
         """ [UNIT]... -- disable these units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.disable_units(units) and found_all
     def disable_units(self, units):
         self.wait_system()
@@ -3185,6 +4497,7 @@ class Systemctl:
                     logg.error("disable %s: %s", target, e)
                 except OSError as e:
                     logg.error("disable %s: %s", target, e)
+                self.update_wants_folder(folder)
         return True
     def disable_unit_sysv(self, unit_file):
         rc3 = self._disable_unit_sysv(unit_file, self.rc3_root_folder())
@@ -3219,17 +4532,8 @@ class Systemctl:
     def is_enabled_modules(self, *modules):
         """ [UNIT]... -- check if these units are enabled 
         returns True if any of them is enabled."""
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.is_enabled_units(units) # and found_all
     def is_enabled_units(self, units):
         """ true if any is enabled, and a list of infos """
@@ -3250,12 +4554,13 @@ class Systemctl:
         wanted = self.wanted_from(self.get_unit_conf(unit))
         if not wanted:
             return True # "static"
+        name = os.path.basename(unit_file)
         for folder in self.enablefolders(wanted):
             if self._root:
                 folder = os_path(self._root, folder)
-            target = os.path.join(folder, os.path.basename(unit_file))
-            if os.path.isfile(target):
-                return True
+            if name in self.wants_folder_entries(folder):
+                if os.path.isfile(os.path.join(folder, name)):
+                    return True
         return False
     def enabled_unit(self, unit):
         conf = self.get_unit_conf(unit)
@@ -3272,26 +4577,18 @@ class Systemctl:
         wanted = self.wanted_from(conf)
         if not wanted:
             return "static"
+        name = os.path.basename(unit_file)
         for folder in self.enablefolders(wanted):
             if self._root:
                 folder = os_path(self._root, folder)
-            target = os.path.join(folder, os.path.basename(unit_file))
-            if os.path.isfile(target):
-                return "enabled"
+            if name in self.wants_folder_entries(folder):
+                if os.path.isfile(os.path.join(folder, name)):
+                    return "enabled"
         return "disabled"
     def mask_modules(self, *modules):
         """ [UNIT]... -- mask non-startable units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.mask_units(units) and found_all
     def mask_units(self, units):
         self.wait_system()
@@ -3346,17 +4643,8 @@ class Systemctl:
                  yield folder
     def unmask_modules(self, *modules):
         """ [UNIT]... -- unmask non-startable units """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.unmask_units(units) and found_all
     def unmask_units(self, units):
         self.wait_system()
@@ -3396,17 +4684,8 @@ class Systemctl:
     def list_dependencies_modules(self, *modules):
         """ [UNIT]... show the dependency tree"
         """
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
         return self.list_dependencies_units(units) # and found_all
     def list_dependencies_units(self, units):
         if self._now:
@@ -3423,47 +4702,23 @@ class Systemctl:
             result += [ line ]
         return result
     def list_dependencies(self, unit, indent = None, mark = None, loop = []):
-        mapping = {}
-        mapping["Requires"] = "required to start"
-        mapping["Wants"] = "wanted to start"
-        mapping["Requisite"] = "required started"
-        mapping["Bindsto"] = "binds to start"
-        mapping["PartOf"] = "part of started"
-        mapping[".requires"] = ".required to start"
-        mapping[".wants"] = ".wanted to start"
-        mapping["PropagateReloadTo"] = "(to be reloaded as well)"
-        mapping["Conflicts"] = "(to be stopped on conflict)"
-        restrict = ["Requires", "Requisite", "ConsistsOf", "Wants", 
-            "BindsTo", ".requires", ".wants"]
         indent = indent or ""
         mark = mark or ""
-        deps = self.get_dependencies_unit(unit)
-        conf = self.get_unit_conf(unit)
-        if not conf.loaded():
+        graph = self.dependency_graph()
+        if self._reverse:
+            graph = graph.reversed()
+        if not graph.loaded(unit):
             if not self._show_all:
                 return
             yield "%s(%s): %s" % (indent, unit, mark)
         else:
             yield "%s%s: %s" % (indent, unit, mark)
-            for stop_recursion in [ "Conflict", "conflict", "reloaded", "Propagate" ]:
-                if stop_recursion in mark:
-                    return
-            for dep in deps:
-                if dep in loop:
-                    logg.debug("detected loop at %s", dep)
-                    continue
-                new_loop = loop + list(deps.keys())
-                new_indent = indent + "| "
-                new_mark = deps[dep]
-                if not self._show_all:
-                    if new_mark not in restrict:
-                        continue
-                if new_mark in mapping:
-                    new_mark = mapping[new_mark]
-                restrict = ["Requires", "Requisite", "ConsistsOf", "Wants", 
-                    "BindsTo", ".requires", ".wants"]
-                for line in self.list_dependencies(dep, new_indent, new_mark, new_loop):
-                    yield line
+            for line in graph.subtree(unit, mark, frozenset(loop)):
+                yield indent + line
+    def dependency_graph(self):
+        if self._dependency_graph is None:
+            self._dependency_graph = UnitDependencyGraph(self)
+        return self._dependency_graph
     def get_dependencies_unit(self, unit):
         conf = self.get_unit_conf(unit)
         deps = {}
@@ -3476,44 +4731,124 @@ class Systemctl:
                     require_path = os.path.join(folder, unit + style)
                     if self._root:
                         require_path = os_path(self._root, require_path)
-                    if os.path.isdir(require_path):
-                        for required in os.listdir(require_path):
-                            if required not in deps:
-                                deps[required] = style
+                    for required in self.wants_folder_entries(require_path):
+                        if required not in deps:
+                            deps[required] = style
             else:
-                for requirelist in conf.getlist("Unit", style, []):
-                    for required in requirelist.strip().split(" "):
-                        deps[required.strip()] = style
+                for required in conf.dependencies().names(style):
+                    deps[required] = style
         return deps
-    def get_start_dependencies(self, unit): # pragma: no cover
-        """ the list of services to be started as well / TODO: unused """
-        deps = {}
-        unit_deps = self.get_dependencies_unit(unit)
-        for dep_unit, dep_style in unit_deps.items():
-            restrict = ["Requires", "Requisite", "ConsistsOf", "Wants", 
-                "BindsTo", ".requires", ".wants"]
-            if dep_style in restrict:
-                if dep_unit in deps:
-                    if dep_style not in deps[dep_unit]:
-                        deps[dep_unit].append( dep_style)
-                else:
-                    deps[dep_unit] = [ dep_style ]
-                next_deps = self.get_start_dependencies(dep_unit)
-                for dep, styles in next_deps.items():
-                    for style in styles:
-                        if dep in deps:
-                            if style not in deps[dep]:
-                                deps[dep].append(style)
-                        else:
-                            deps[dep] = [ style ]
+    def get_start_dependencies(self, unit, restrict = None): # -> { unit : [ style,.. ] }
+        """ the units to be started as well - the transitive closure of the
+            Requires/Wants/BindsTo/.wants/.requires dependencies of a unit """
+        graph = self.dependency_graph()
+        restrict = restrict or ["Requires", "Wants", "BindsTo", ".requires", ".wants"]
+        deps = ordered_dict()
+        todo = collections.deque([ unit ])
+        while todo:
+            current = todo.popleft()
+            for dep_unit, dep_style in graph.deps(current).items():
+                if dep_style not in restrict or dep_unit == unit:
+                    continue
+                if dep_unit not in deps:
+                    deps[dep_unit] = []
+                    todo.append(dep_unit)
+                if dep_style not in deps[dep_unit]:
+                    deps[dep_unit].append(dep_style)
         return deps
+    def propagate_units(self, units, job = "stop", after = None): # -> [ unit,.. ]
+        """ the given units and the active units being PartOf= or BindsTo=
+            them (transitively) - those get the stop/restart propagated
+            (skipped with --job-mode=ignore-dependencies). The 'after' map
+            gets each dependent ordered After= the unit (see UnitOrdering),
+            so that it is stopped first. """
+        result = list(units)
+        if self._job_mode in [ "ignore-dependencies" ]:
+            return result
+        graph = self.dependency_graph()
+        seen = set(result)
+        todo = collections.deque(units)
+        while todo:
+            unit = todo.popleft()
+            for dependent, styles in graph.reverse_deps(unit).items():
+                if "PartOf" not in styles and "BindsTo" not in styles:
+                    continue
+                if after is not None and dependent != unit:
+                    after.setdefault(dependent, set()).add(unit)
+                if dependent in seen:
+                    continue
+                seen.add(dependent)
+                conf = self.load_unit_conf(dependent)
+                if not conf or conf.masked or not self.is_active_from(conf):
+                    continue
+                logg.info("%s %s propagates to %s", job, unit, dependent)
+                result.append(dependent)
+                todo.append(dependent)
+        return result
+    def start_dependencies_units(self, units, wanted = None): # -> [ unit,.. ]
+        """ the given units and the services being pulled in by them, that
+            are not active yet (skipped with --job-mode=ignore-dependencies).
+            The 'wanted' list gets the units that are only pulled in by a
+            Wants= somewhere on the way - their failure is not an error. """
+        result = list(units)
+        if self._job_mode in [ "ignore-dependencies" ]:
+            return result
+        required = set(units)
+        for unit in units:
+            required.update(self.get_start_dependencies(unit, ["Requires", "BindsTo", ".requires"]))
+        for unit in units:
+            for dep_unit in self.get_start_dependencies(unit):
+                if dep_unit in result or not dep_unit.endswith(".service"):
+                    continue
+                conf = self.load_unit_conf(dep_unit)
+                if not conf or conf.masked:
+                    continue
+                if self.is_active_from(conf):
+                    continue
+                logg.info("%s pulls in %s", unit, dep_unit)
+                result.append(dep_unit)
+                if wanted is not None and dep_unit not in required:
+                    wanted.append(dep_unit)
+        return result
+    def start_transaction_units(self, units, wanted = None): # -> ([ unit,.. ], [ failed,.. ])
+        """ the given units and the ones pulled in by them - without the
+            units whose Requisite= is not active (nor what they pull in).
+            The 'wanted' units are not reported as failed (see above). """
+        failed = self.inactive_requisite_units(units)
+        units = self.start_dependencies_units([ unit for unit in units if unit not in failed ], wanted)
+        pulled = self.inactive_requisite_units(units)
+        failed += [ unit for unit in pulled if unit not in (wanted or []) ]
+        return [ unit for unit in units if unit not in pulled ], failed
+    def inactive_requisite_units(self, units): # -> [ unit,.. ]
+        """ the units that can not be started because a Requisite= service
+            is not active - a Requisite= unit is never started along. Other
+            unit types are only warned about as their state is not tracked.
+            (skipped with --job-mode=ignore-dependencies) """
+        failed = []
+        if self._job_mode in [ "ignore-dependencies" ]:
+            return failed
+        for unit in units:
+            conf = self.load_unit_conf(unit)
+            if not conf: continue
+            for requisite in conf.dependencies().names("Requisite"):
+                requisite_conf = self.load_unit_conf(requisite)
+                if requisite_conf is not None and self.is_active_from(requisite_conf):
+                    continue
+                if not requisite.endswith(".service"):
+                    logg.warning("%s has Requisite=%s which may not be active", unit, requisite)
+                    continue
+                logg.error("Unit %s needs Requisite=%s which is not active", unit, requisite)
+                failed.append(unit)
+                break
+        return failed
     def list_start_dependencies_units(self, units):
+        graph = self.dependency_graph()
         unit_order = []
         deps = {}
         for unit in units:
             unit_order.append(unit)
             # unit_deps = self.get_start_dependencies(unit) # TODO
-            unit_deps = self.get_dependencies_unit(unit)
+            unit_deps = graph.deps(unit)
             for dep_unit, styles in unit_deps.items():
                 styles = to_list(styles)
                 for dep_style in styles:
@@ -3526,16 +4861,14 @@ class Systemctl:
         for dep in deps:
             if dep in unit_order:
                 continue
-            conf = self.get_unit_conf(dep)
-            if conf.loaded():
-                deps_conf.append(conf)
+            if graph.loaded(dep):
+                deps_conf.append(self.get_unit_conf(dep))
         for unit in unit_order:
             deps[unit] = [ "Requested" ]
-            conf = self.get_unit_conf(unit)
-            if conf.loaded():
-                deps_conf.append(conf)
+            if graph.loaded(unit):
+                deps_conf.append(self.get_unit_conf(unit))
         result = []
-        for dep in sortedAfter(deps_conf, cmp=compareAfter):
+        for dep in UnitOrdering(deps_conf).sorted():
             line = (dep.name(),  "(%s)" % (" ".join(deps[dep.name()])))
             result.append(line)
         return result
@@ -3550,9 +4883,9 @@ class Systemctl:
                     logg.debug("ignoring masked unit %s", unit)
                     continue
                 conflist.append(conf)
-        sortlist = sortedAfter(conflist)
+        sortlist = UnitOrdering(conflist).sorted()
         return [ item.name() for item in sortlist ]
-    def sortedBefore(self, unitlist):
+    def sortedBefore(self, unitlist, after = None):
         """ get correct start order for the unit list (ignoring masked units) """
         conflist = [ self.get_unit_conf(unit) for unit in unitlist ]
         if True:
@@ -3563,7 +4896,7 @@ class Systemctl:
                     logg.debug("ignoring masked unit %s", unit)
                     continue
                 conflist.append(conf)
-        sortlist = sortedAfter(reversed(conflist))
+        sortlist = UnitOrdering(reversed(conflist), after).sorted()
         return [ item.name() for item in reversed(sortlist) ]
     def system_daemon_reload(self):
         """ reload does will only check the service files here.
@@ -3571,26 +4904,78 @@ class Systemctl:
             and it is over 100 if it can not continue even
             for the relaxed systemctl.py style of execution. """
         errors = 0
-        for unit in self.match_units():
+        checked = 0
+        summary = []
+        units = self.match_units()
+        self.load_unit_confs(units)
+        for unit in units:
             try:
                 conf = self.get_unit_conf(unit)
             except Exception as e:
                 logg.error("%s: can not read unit file %s\n\t%s", 
                     unit, conf.filename(), e)
                 continue
-            errors += self.syntax_check(conf)
+            filename = conf.filename()
+            if not filename or not filename.endswith(".service"):
+                continue # same as syntax_check
+            unit_errors, problems, cached = self.syntax_check_service_problems(conf)
+            for level, message in problems:
+                logg.log(level, "%s", message)
+            errors += unit_errors
+            if not cached:
+                checked += 1
+            if problems:
+                messages = [ { "level": logging.getLevelName(level), "message": message.strip() }
+                             for level, message in problems ]
+                summary.append({ "unit": unit, "file": filename, "errors": unit_errors, "messages": messages })
         if errors:
             logg.warning(" (%s) found %s problems", errors, errors % 100)
+        logg.debug("daemon-reload checked %s units (others unchanged)", checked)
+        self.reload_init_loop()
+        if self._output == "json":
+            result = { "units": len(units), "checked": checked, "errors": errors, "problems": summary }
+            return (True, json.dumps(result, indent = 2, sort_keys = True))
         return True # errors
+    def reload_init_loop(self):
+        """ a systemctl init process reloads its unit files on SIGHUP - it is
+            found by its pid file (for the same --root and --user mode) """
+        pid = read_init_pid(self.cache_file(_init_pid_file))
+        if not pid or pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, signal.SIGHUP)
+            logg.debug("sent SIGHUP to the init process PID %s", pid)
+        except OSError as e:
+            logg.warning("SIGHUP to the init process PID %s: %s", pid, e)
+            return False
+        return True
     def syntax_check(self, conf):
         if conf.filename() and conf.filename().endswith(".service"):
             return self.syntax_check_service(conf)
         return 0
     def syntax_check_service(self, conf):
+        errors, problems, cached = self.syntax_check_service_problems(conf)
+        for level, message in problems:
+            logg.log(level, "%s", message)
+        return errors
+    def syntax_check_service_problems(self, conf): # -> (errors, [ (level, message) ], cached)
+        """ the problems of a unit are taken from the check cache as long
+            as the unit files and the environment files have not changed """
+        check = self.read_check_cache(conf)
+        if check is not None:
+            return check[0], check[1], True
+        check = self.syntax_problems_from(conf)
+        self.write_check_cache(conf, check)
+        return check[0], check[1], False
+    def syntax_problems_from(self, conf): # -> (errors, [ (level, message) ], [ (env_file, exists) ])
         unit = conf.name()
+        problems = []
+        env_files = []
+        def problem(level, msg, *args):
+            problems.append((level, msg % args))
         if not conf.data.has_section("Service"):
-           logg.error(" %s: a .service file without [Service] section", unit)
-           return 101
+           problem(logging.ERROR, " %s: a .service file without [Service] section", unit)
+           return 101, problems, env_files
         errors = 0
         haveType = conf.get("Service", "Type", "simple")
         haveExecStart = conf.getlist("Service", "ExecStart", [])
@@ -3600,61 +4985,87 @@ class Systemctl:
         usedExecStop = []
         usedExecReload = []
         if haveType not in [ "simple", "forking", "notify", "oneshot", "dbus", "idle", "sysv"]:
-            logg.error(" %s: Failed to parse service type, ignoring: %s", unit, haveType)
+            problem(logging.ERROR, " %s: Failed to parse service type, ignoring: %s", unit, haveType)
             errors += 100
         for line in haveExecStart:
             if not line.startswith("/") and not line.startswith("-/"):
-                logg.error(" %s: Executable path is not absolute, ignoring: %s", unit, line.strip())
+                problem(logging.ERROR, " %s: Executable path is not absolute, ignoring: %s", unit, line.strip())
                 errors += 1
             usedExecStart.append(line)
         for line in haveExecStop:
             if not line.startswith("/") and not line.startswith("-/"):
-                logg.error(" %s: Executable path is not absolute, ignoring: %s", unit, line.strip())
+                problem(logging.ERROR, " %s: Executable path is not absolute, ignoring: %s", unit, line.strip())
                 errors += 1
             usedExecStop.append(line)
         for line in haveExecReload:
             if not line.startswith("/") and not line.startswith("-/"):
-                logg.error(" %s: Executable path is not absolute, ignoring: %s", unit, line.strip())
+                problem(logging.ERROR, " %s: Executable path is not absolute, ignoring: %s", unit, line.strip())
                 errors += 1
             usedExecReload.append(line)
         if haveType in ["simple", "notify", "forking"]:
             if not usedExecStart and not usedExecStop:
-                logg.error(" %s: Service lacks both ExecStart and ExecStop= setting. Refusing.", unit)
+                problem(logging.ERROR, " %s: Service lacks both ExecStart and ExecStop= setting. Refusing.", unit)
                 errors += 101
             elif not usedExecStart and haveType != "oneshot":
-                logg.error(" %s: Service has no ExecStart= setting, which is only allowed for Type=oneshot services. Refusing.",  unit)
+                problem(logging.ERROR, " %s: Service has no ExecStart= setting, which is only allowed for Type=oneshot services. Refusing.",  unit)
                 errors += 101
         if len(usedExecStart) > 1 and haveType != "oneshot":
-            logg.error(" %s: there may be only one ExecStart statement (unless for 'oneshot' services)."
+            problem(logging.ERROR, " %s: there may be only one ExecStart statement (unless for 'oneshot' services)."
               + "\n\t\t\tYou can use ExecStartPre / ExecStartPost to add additional commands.", unit)
             errors += 1
         if len(usedExecStop) > 1 and haveType != "oneshot":
-            logg.info(" %s: there should be only one ExecStop statement (unless for 'oneshot' services)."
+            problem(logging.INFO, " %s: there should be only one ExecStop statement (unless for 'oneshot' services)."
               + "\n\t\t\tYou can use ExecStopPost to add additional commands (also executed on failed Start)", unit)
         if len(usedExecReload) > 1:
-            logg.info(" %s: there should be only one ExecReload statement."
+            problem(logging.INFO, " %s: there should be only one ExecReload statement."
               + "\n\t\t\tUse ' ; ' for multiple commands (ExecReloadPost or ExedReloadPre do not exist)", unit)
         if len(usedExecReload) > 0 and "/bin/kill " in usedExecReload[0]:
-            logg.warning(" %s: the use of /bin/kill is not recommended for ExecReload as it is asychronous."
+            problem(logging.WARNING, " %s: the use of /bin/kill is not recommended for ExecReload as it is asychronous."
               + "\n\t\t\tThat means all the dependencies will perform the reload simultanously / out of order.", unit)
         if conf.getlist("Service", "ExecRestart", []): #pragma: no cover
-            logg.error(" %s: there no such thing as an ExecRestart (ignored)", unit)
+            problem(logging.ERROR, " %s: there no such thing as an ExecRestart (ignored)", unit)
         if conf.getlist("Service", "ExecRestartPre", []): #pragma: no cover
-            logg.error(" %s: there no such thing as an ExecRestartPre (ignored)", unit)
+            problem(logging.ERROR, " %s: there no such thing as an ExecRestartPre (ignored)", unit)
         if conf.getlist("Service", "ExecRestartPost", []): #pragma: no cover 
-            logg.error(" %s: there no such thing as an ExecRestartPost (ignored)", unit)
+            problem(logging.ERROR, " %s: there no such thing as an ExecRestartPost (ignored)", unit)
         if conf.getlist("Service", "ExecReloadPre", []): #pragma: no cover
-            logg.error(" %s: there no such thing as an ExecReloadPre (ignored)", unit)
+            problem(logging.ERROR, " %s: there no such thing as an ExecReloadPre (ignored)", unit)
         if conf.getlist("Service", "ExecReloadPost", []): #pragma: no cover
-            logg.error(" %s: there no such thing as an ExecReloadPost (ignored)", unit)
+            problem(logging.ERROR, " %s: there no such thing as an ExecReloadPost (ignored)", unit)
         if conf.getlist("Service", "ExecStopPre", []): #pragma: no cover
-            logg.error(" %s: there no such thing as an ExecStopPre (ignored)", unit)
+            problem(logging.ERROR, " %s: there no such thing as an ExecStopPre (ignored)", unit)
         for env_file in conf.getlist("Service", "EnvironmentFile", []):
             if env_file.startswith("-"): continue
-            if not os.path.isfile(os_path(self._root, env_file)):
-                logg.error(" %s: Failed to load environment files: %s", unit, env_file)
+            exists = os.path.isfile(os_path(self._root, env_file))
+            env_files.append((env_file, exists))
+            if not exists:
+                problem(logging.ERROR, " %s: Failed to load environment files: %s", unit, env_file)
                 errors += 101
-        return errors
+        return errors, problems, env_files
+    def read_check_cache(self, conf): # -> check?
+        """ the syntax check results are kept with the unit cache """
+        filename = conf.filename()
+        checks = self.load_check_cache()
+        if filename not in checks:
+            return None
+        identity, check = checks[filename]
+        if identity != self.file_identity(conf.data.filenames()):
+            return None
+        for env_file, exists in check[2]:
+            if os.path.isfile(os_path(self._root, env_file)) != exists:
+                return None
+        return check
+    def write_check_cache(self, conf, check):
+        filename = conf.filename()
+        checks = self.load_check_cache()
+        identity = self.file_identity(conf.data.filenames())
+        if identity is None or conf.masked:
+            if checks.pop(filename, None) is not None:
+                self._unit_cache_changed = True
+            return False
+        checks[filename] = (identity, (check[0], tuple(check[1]), tuple(check[2])))
+        self._unit_cache_changed = True
+        return True
     def exec_check_service(self, conf, env, exectype = ""):
         if not conf:
             return True
@@ -3725,8 +5136,7 @@ class Systemctl:
         notfound = []
         found_all = True
         units = []
-        for module in modules:
-            matched = self.match_units([ module ])
+        for module, matched in self.match_modules(modules):
             if not matched:
                 logg.error("Unit %s could not be found.", unit_of(module))
                 units += [ module ]
@@ -3829,32 +5239,30 @@ class Systemctl:
             folder = self.default_enablefolder(default_target, basefolder)
             if self._root:
                 folder = os_path(self._root, folder)
-            if os.path.isdir(folder):
-                for unit in sorted(os.listdir(folder)):
-                    path = os.path.join(folder, unit)
-                    if os.path.isdir(path): continue
-                    if self._ignored_unit(unit, igno):
-                        continue # ignore
-                    if unit.endswith(".service"):
-                        default_services.append(unit)
+            for unit in sorted(self.wants_folder_entries(folder)):
+                path = os.path.join(folder, unit)
+                if os.path.isdir(path): continue
+                if self._ignored_unit(unit, igno):
+                    continue # ignore
+                if unit.endswith(".service"):
+                    default_services.append(unit)
         for basefolder in self.system_folders():
             if not basefolder:
                 continue
             folder = self.default_enablefolder(default_target, basefolder)
             if self._root:
                 folder = os_path(self._root, folder)
-            if os.path.isdir(folder):
-                for unit in sorted(os.listdir(folder)):
-                    path = os.path.join(folder, unit)
-                    if os.path.isdir(path): continue
-                    if self._ignored_unit(unit, igno):
-                        continue # ignore
-                    if unit.endswith(".service"):
-                        conf = self.load_unit_conf(unit)
-                        if self.not_user_conf(conf):
-                            pass 
-                        else:
-                            default_services.append(unit)
+            for unit in sorted(self.wants_folder_entries(folder)):
+                path = os.path.join(folder, unit)
+                if os.path.isdir(path): continue
+                if self._ignored_unit(unit, igno):
+                    continue # ignore
+                if unit.endswith(".service"):
+                    conf = self.load_unit_conf(unit)
+                    if self.not_user_conf(conf):
+                        pass 
+                    else:
+                        default_services.append(unit)
         return default_services
     def enabled_default_system_services(self, sysv = "S", default_target = None, igno = []):
         logg.debug("check for default system services")
@@ -3866,14 +5274,13 @@ class Systemctl:
             folder = self.default_enablefolder(default_target, basefolder)
             if self._root:
                 folder = os_path(self._root, folder)
-            if os.path.isdir(folder):
-                for unit in sorted(os.listdir(folder)):
-                    path = os.path.join(folder, unit)
-                    if os.path.isdir(path): continue
-                    if self._ignored_unit(unit, igno):
-                        continue # ignore
-                    if unit.endswith(".service"):
-                        default_services.append(unit)
+            for unit in sorted(self.wants_folder_entries(folder)):
+                path = os.path.join(folder, unit)
+                if os.path.isdir(path): continue
+                if self._ignored_unit(unit, igno):
+                    continue # ignore
+                if unit.endswith(".service"):
+                    default_services.append(unit)
         for folder in [ self.rc3_root_folder() ]:
             if not os.path.isdir(folder):
                 logg.warning("non-existant %s", folder)
@@ -3900,7 +5307,10 @@ class Systemctl:
         self.sysinit_status(SubState = "initializing")
         logg.info("system default requested - %s", arg)
         init = self._now or self._init
-        self.start_system_default(init = init)
+        if not init:
+            return self.start_system_default(init = init)
+        with InitProcess(self):
+            return self.start_system_default(init = init)
     def start_system_default(self, init = False):
         """ detect the default.target services and start them.
             When --init is given then the init-loop is run and
@@ -3914,15 +5324,15 @@ class Systemctl:
             logg.info("init-loop start")
             sig = self.init_loop_until_stop(default_services)
             logg.info("init-loop %s", sig)
-            self.stop_system_default()
-    def stop_system_default(self):
+            self.stop_system_default(self.shutdown_deadline())
+    def stop_system_default(self, deadline = None):
         """ detect the default.target services and stop them.
             This is commonly run through 'systemctl halt' or
             at the end of a 'systemctl --init default' loop."""
         default_target = self._default_target
         default_services = self.system_default_services("K", default_target)
         self.sysinit_status(SubState = "stopping")
-        self.stop_units(default_services)
+        self.stop_units(default_services, shutdown = True, deadline = deadline)
         logg.info(" -- system is down")
     def system_halt(self, arg = True):
         """ stop units from default system level """
@@ -3984,6 +5394,9 @@ class Systemctl:
         with the reap-zombies function and waiting for an interrupt.
         (and no unit is started/stoppped wether given or not).
         """
+        with InitProcess(self):
+            return self.init_units_from(modules)
+    def init_units_from(self, modules):
         if self._now:
             return self.init_loop_until_stop([])
         if not modules:
@@ -3998,19 +5411,12 @@ class Systemctl:
         if self._now or self._show_all:
             logg.debug("init services --now --all => no_more_procs")
             self.exit_when_no_more_procs = True
-        found_all = True
-        units = []
-        for module in modules:
-            matched = self.match_units([ module ])
-            if not matched:
-                logg.error("Unit %s could not be found.", unit_of(module))
-                found_all = False
-                continue
-            for unit in matched:
-                if unit not in units:
-                    units += [ unit ]
+        units, missing = self.resolve_modules(modules)
+        found_all = not missing
+        wanted = []
+        units, failed = self.start_transaction_units(units, wanted)
         logg.info("init %s -> start %s", ",".join(modules), ",".join(units))
-        done = self.start_units(units, init = True) 
+        done = self.start_units(units, init = True, wanted = wanted) and not failed
         logg.info("-- init is done")
         return done # and found_all
     def start_log_files(self, units):
@@ -4026,6 +5432,23 @@ class Systemctl:
                 self._log_hold[unit] = b""
             except Exception as e:
                 logg.error("can not open %s log: %s\n\t%s", unit, log_path, e)
+        self.watch_log_files(units)
+    def watch_log_files(self, units):
+        """ inotify on the journal log folders - a write wakes up the init-loop """
+        if self._log_watch is None:
+            try:
+                self._log_watch = InotifyWatch()
+            except Exception as e:
+                logg.info("no inotify on the journal logs (%s) - reading every %ss", e, InitLoopSleep)
+                return False
+        for unit in units:
+            if unit in self._log_file:
+                log_folder = os.path.dirname(self.path_journal_log(self.load_unit_conf(unit)))
+                if not self._log_watch.add(log_folder):
+                    self._log_watch.close()
+                    self._log_watch = None
+                    return False
+        return True
     def read_log_files(self, units):
         BUFSIZE=8192
         for unit in units:
@@ -4058,6 +5481,175 @@ class Systemctl:
                 logg.error("can not close log: %s\n\t%s", unit, e)
         self._log_file = {}
         self._log_hold = {}
+        if self._log_watch is not None:
+            self._log_watch.close()
+            self._log_watch = None
+    def request_unit_reload(self):
+        """ SIGHUP in the init-loop (as sent by 'systemctl daemon-reload') """
+        self._unit_reload = True
+    def watch_unit_files(self):
+        """ the init-loop has a live registry of the unit files where the
+            unit index is updated from inotify events on the unit folders.
+            Without inotify the mtime of the unit folders is checked. """
+        self.scan_unit_files()
+        if self._unit_watch is None:
+            try:
+                self._unit_watch = InotifyWatch(InotifyWatch.IN_FILE_CHANGES)
+            except Exception as e:
+                logg.info("no inotify on the unit folders (%s) - checking their mtime", e)
+                return False
+        for folder, mtime in self._unit_index["folders"]:
+            if mtime is not None:
+                self._unit_watch.add(folder)
+        logg.debug("watching %s unit folders", len(self._unit_watch.watches))
+        return True
+    def unwatch_unit_files(self):
+        if self._unit_watch is not None:
+            self._unit_watch.close()
+            self._unit_watch = None
+    def update_unit_files(self):
+        """ check the unit folders for changes (in the init-loop) and
+            reload the changed unit files only. Returns the reloaded units. """
+        if self._unit_index is None:
+            return []
+        reload_all = False
+        changed = set()
+        if self._unit_watch is not None:
+            sysd_folders = self._unit_index["sysd_folders"]
+            sysv_folders = self._unit_index["sysv_folders"]
+            for folder, name, mask in self._unit_watch.read():
+                if folder is None:
+                    logg.info("inotify overflow - reload all unit files")
+                    reload_all = True
+                    continue
+                if mask & (InotifyWatch.IN_DELETE_SELF | InotifyWatch.IN_MOVE_SELF):
+                    if folder in sysd_folders or folder in sysv_folders:
+                        reload_all = True
+                    elif folder.endswith(".d"):
+                        changed.add(os.path.basename(folder)[:-2])
+                    else:
+                        self.update_wants_folder(folder)
+                    continue
+                if folder in sysv_folders:
+                    changed.add(name + ".service") # simulate systemd
+                elif folder in sysd_folders:
+                    if mask & InotifyWatch.IN_ISDIR:
+                        path = os.path.join(folder, name)
+                        if name.endswith(".d") or name.endswith(".wants") or name.endswith(".requires"):
+                            if os.path.isdir(path):
+                                self._unit_watch.add(path)
+                        if name.endswith(".wants") or name.endswith(".requires"):
+                            self.update_wants_folder(path)
+                        if name.endswith(".d"):
+                            changed.add(name[:-2])
+                        continue
+                    changed.add(name)
+                elif folder.endswith(".d"):
+                    changed.add(os.path.basename(folder)[:-2])
+                else:
+                    self.update_wants_folder(folder)
+            # the unit folders that did not exist yet are not watched
+            for folder, mtime in self._unit_index["folders"]:
+                if mtime is None and os_folder_mtime(folder) is not None:
+                    reload_all = True
+        else:
+            for folder, mtime in self._unit_index["folders"]:
+                if os_folder_mtime(folder) != mtime:
+                    logg.debug("unit folder changed %s", folder)
+                    reload_all = True
+                    break
+        if self._unit_reload:
+            self._unit_reload = False
+            if self._unit_watch is None:
+                reload_all = True # SIGHUP
+        if reload_all:
+            return self.reload_all_unit_files()
+        if changed:
+            return self.reload_unit_files(changed)
+        return []
+    def reload_all_unit_files(self):
+        """ forget all unit files and scan the unit folders again.
+            The unchanged units are taken from the unit cache. """
+        units = list(self._file_for_unit_sysd or []) + list(self._file_for_unit_sysv or [])
+        self._loaded_file_sysd = {}
+        self._loaded_file_sysv = {}
+        self._file_for_unit_sysd = None
+        self._file_for_unit_sysv = None
+        self._unit_index = None
+        self.scan_unit_files()
+        if self._unit_watch is not None:
+            self.watch_unit_files()
+        units += list(self._file_for_unit_sysd) + list(self._file_for_unit_sysv)
+        return self.reload_unit_files(set(units), rescanned = True)
+    def reload_unit_files(self, units, rescanned = False):
+        """ incremental daemon-reload - the unit index is updated for the
+            given unit names and they are parsed again (and checked) """
+        index = self._unit_index
+        self._dependency_graph = None
+        for unit in units:
+            for files, loaded in [ (self._file_for_unit_sysd, self._loaded_file_sysd),
+                                   (self._file_for_unit_sysv, self._loaded_file_sysv) ]:
+                path = files.get(unit)
+                if path:
+                    loaded.pop(path, None)
+            if rescanned:
+                continue
+            found = None
+            for folder in index["sysd_folders"]:
+                path = os.path.join(folder, unit)
+                if os.path.exists(path) and not os.path.isdir(path):
+                    found = path
+                    break
+            if found:
+                self._file_for_unit_sysd[unit] = found
+            else:
+                self._file_for_unit_sysd.pop(unit, None)
+            found = None
+            if unit.endswith(".service"):
+                for folder in index["sysv_folders"]:
+                    path = os.path.join(folder, unit[:-len(".service")])
+                    if os.path.exists(path) and not os.path.isdir(path):
+                        found = path
+                        break
+            if found:
+                self._file_for_unit_sysv[unit] = found
+            else:
+                self._file_for_unit_sysv.pop(unit, None)
+            drop_in_files = {}
+            for folder in index["sysd_folders"]:
+                path = os.path.join(folder, unit + ".d")
+                if not os.path.isdir(path):
+                    continue
+                for name in os.listdir(path):
+                    conf_path = os.path.join(path, name)
+                    if name.endswith(".conf") and not os.path.isdir(conf_path):
+                        if name not in drop_in_files:
+                            drop_in_files[name] = conf_path
+            if drop_in_files:
+                self._drop_in_files[unit] = drop_in_files
+            else:
+                self._drop_in_files.pop(unit, None)
+            for files, loaded in [ (self._file_for_unit_sysd, self._loaded_file_sysd),
+                                   (self._file_for_unit_sysv, self._loaded_file_sysv) ]:
+                path = files.get(unit)
+                if path:
+                    loaded.pop(path, None)
+        self._sorted_units_sysd = sorted(self._file_for_unit_sysd)
+        self._sorted_units_sysv = sorted(self._file_for_unit_sysv)
+        self._template_units = None
+        reloaded = []
+        errors = 0
+        for unit in sorted(units):
+            conf = self.load_unit_conf(unit)
+            if conf is None:
+                continue
+            errors += self.syntax_check(conf)
+            reloaded.append(unit)
+        logg.info("reloaded %s unit files", len(reloaded))
+        if errors:
+            logg.warning(" (%s) found %s problems", errors, errors % 100)
+        self.save_unit_cache()
+        return reloaded
     def init_loop_until_stop(self, units):
         """ this is the init-loop - it checks for any zombies to be reaped and
             waits for an interrupt. When a SIGTERM /SIGINT /Control-C signal
@@ -4068,14 +5660,19 @@ class Systemctl:
         signal.signal(signal.SIGINT, lambda signum, frame: ignore_signals_and_raise_keyboard_interrupt("SIGINT"))
         signal.signal(signal.SIGTERM, lambda signum, frame: ignore_signals_and_raise_keyboard_interrupt("SIGTERM"))
         self.start_log_files(units)
+        self.save_unit_cache() # the init-loop does not return soon
+        self.watch_unit_files()
+        self.watch_child_exits()
         self.sysinit_status(ActiveState = "active", SubState = "running")
         result = None
         while True:
             try:
-                time.sleep(InitLoopSleep)
+                # the first round does not wait - children may have exited
+                # before the SIGCHLD wakeup was set up
                 self.read_log_files(units)
+                self.update_unit_files()
                 ##### the reaper goes round
-                running = self.system_reap_zombies()
+                running = self.system_reap_zombies(units)
                 # logg.debug("reap zombies - init-loop found %s running procs", running)
                 if self.exit_when_no_more_services:
                     active = False
@@ -4091,57 +5688,134 @@ class Systemctl:
                     if not running:
                         logg.info("no more procs - exit init-loop")
                         break
+                self.wait_init_loop(self.init_loop_timeout())
             except KeyboardInterrupt as e:
                 if e.args and e.args[0] == "SIGQUIT":
                     # the original systemd puts a coredump on that signal.
                     logg.info("SIGQUIT - switch to no more procs check")
                     self.exit_when_no_more_procs = True
                     continue
+                self._interrupted = time.time()
                 signal.signal(signal.SIGTERM, signal.SIG_DFL)
                 signal.signal(signal.SIGINT, signal.SIG_DFL)
                 logg.info("interrupted - exit init-loop")
-                result = e.message or "STOPPED"
+                result = e.args and e.args[0] or "STOPPED"
                 break
             except Exception as e:
                 logg.info("interrupted - exception %s", e)
                 raise
         self.sysinit_status(ActiveState = None, SubState = "degraded")
+        # the SIGQUIT of 'systemctl halt' may come after its stop has already
+        # woken up the init-loop - we are shutting down anyway.
+        signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+        self.unwatch_child_exits()
+        self.unwatch_unit_files()
         self.read_log_files(units)
         self.read_log_files(units)
         self.stop_log_files(units)
         logg.debug("done - init loop")
         return result
-    def system_reap_zombies(self):
-        """ check to reap children """
+    def watch_child_exits(self):
+        """ the init-loop is woken up by SIGCHLD (if possible) """
+        if self._child_wakeup is None:
+            try:
+                self._child_wakeup = SignalWakeup([ signal.SIGCHLD ])
+            except Exception as e:
+                logg.info("no SIGCHLD wakeup (%s) - reaping every %ss", e, InitLoopSleep)
+                return False
+        return True
+    def unwatch_child_exits(self):
+        if self._child_wakeup is not None:
+            self._child_wakeup.close()
+            self._child_wakeup = None
+    def init_loop_timeout(self):
+        """ the plain init-loop does not need to wake up periodically as all
+            its work is triggered by events: the exit of children (SIGCHLD),
+            unit folder changes and journal log writes. Checking for no more
+            services/procs is periodic - 'docker exec' procs (like the
+            'systemctl halt' itself) are not our children and status-only
+            changes (a stopped RemainAfterExit unit) have no event at all. """
+        if self._child_wakeup is None or self._unit_watch is None or self._log_watch is None:
+            return InitLoopSleep
+        if self.exit_when_no_more_services or self.exit_when_no_more_procs:
+            return InitLoopSleep
+        return None
+    def wait_init_loop(self, timeout = None): # -> [ fd,.. ]
+        """ wait for a signal, inotify on the unit folders or journal logs """
+        watched = [ self._child_wakeup, self._unit_watch, self._log_watch ]
+        fds = [ watch.fd for watch in watched if watch is not None and watch.fd >= 0 ]
+        if not fds:
+            time.sleep(timeout or InitLoopSleep)
+            return []
+        try:
+            if selectors is None:
+                ready, _, _ = select.select(fds, [], [], timeout)
+            else:
+                selector = selectors.DefaultSelector()
+                try:
+                    for fd in fds:
+                        selector.register(fd, selectors.EVENT_READ)
+                    ready = [ key.fd for key, events in selector.select(timeout) ]
+                finally:
+                    selector.close()
+        except (select.error, OSError) as e:
+            if e.args and e.args[0] == errno.EINTR:
+                ready = [] # python2 does not retry
+            else:
+                raise
+        if self._child_wakeup is not None:
+            self._child_wakeup.read()
+        if self._log_watch is not None:
+            self._log_watch.read() # the logs are read anyway
+        return ready
+    def system_reap_zombies(self, units = None):
+        """ reap the exited children - the exit code of a unit's MainPID is
+            recorded in its status. Returns the number of the other procs. """
+        reaped = {}
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                break # ECHILD
+            if not pid:
+                break
+            logg.info("reap zombie %s", pid)
+            reaped[pid] = status
+        self._procs.refresh() # init-loop tick
+        if reaped:
+            self.reaped_main_pids(units or [], reaped)
+        return self.system_running_procs()
+    def reaped_main_pids(self, units, reaped):
+        for unit in units:
+            conf = self.load_unit_conf(unit)
+            if not conf: continue
+            pid = to_int(self.read_mainpid_from(conf, ""))
+            if pid not in reaped:
+                continue
+            status = reaped[pid]
+            if os.WIFSIGNALED(status):
+                returncode = 128 + os.WTERMSIG(status)
+            else:
+                returncode = os.WEXITSTATUS(status)
+            logg.info("%s main PID %s exited (%s)", unit, pid, returncode)
+            with waitlock(conf):
+                conf.status = None # re-read, it may have been changed by another systemctl call
+                if to_int(self.read_mainpid_from(conf, "")) != pid:
+                    continue # restarted meanwhile
+                self.write_status_from(conf, ExecMainCode = returncode)
+    def system_running_procs(self):
+        """ the number of procs except PID 0, PID 1 and ourselves - the
+            /proc entries are counted without reading them """
         selfpid = os.getpid()
         running = 0
-        for pid in os.listdir("/proc"):
-            try: pid = int(pid)
+        for name in os.listdir("/proc"):
+            try: pid = int(name)
             except: continue
-            if pid == selfpid:
-                continue
-            proc_status = "/proc/%s/status" % pid
-            if os.path.isfile(proc_status):
-                zombie = False
-                ppid = -1
-                try:
-                    for line in open(proc_status):
-                        m = re.match(r"State:\s*Z.*", line)
-                        if m: zombie = True
-                        m = re.match(r"PPid:\s*(\d+)", line)
-                        if m: ppid = int(m.group(1))
-                except IOError as e:
-                    logg.warning("%s : %s", proc_status, e)
-                    continue
-                if zombie and ppid == os.getpid():
-                    logg.info("reap zombie %s", pid)
-                    try: os.waitpid(pid, os.WNOHANG)
-                    except OSError as e: 
-                        logg.warning("reap zombie %s: %s", e.strerror)
-            if os.path.isfile(proc_status):
-                if pid > 1:
-                    running += 1
-        return running # except PID 0 and PID 1
+            if pid > 1 and pid != selfpid:
+                running += 1
+        return running
     def sysinit_status(self, **status):
         conf = self.sysinit_target()
         self.write_status_from(conf, **status)
@@ -4185,30 +5859,25 @@ class Systemctl:
                 logg.info("system is %s", state)
             break
     def pidlist_of(self, pid):
+        """ the pid and its descendants (breadth first, up to ProcMaxDepth
+            levels) from the parent-to-children map of the /proc snapshot """
         try: pid = int(pid)
         except: return []
-        pidlist = [ pid ]
+        children = self._procs.children()
         pids = [ pid ]
+        seen = set(pids)
+        level = [ pid ]
         for depth in xrange(ProcMaxDepth):
-            for pid in os.listdir("/proc"):
-                try: pid = int(pid)
-                except: continue
-                proc_status = "/proc/%s/status" % pid
-                if os.path.isfile(proc_status):
-                    try:
-                        for line in open(proc_status):
-                            if line.startswith("PPid:"):
-                                ppid = line[len("PPid:"):].strip()
-                                try: ppid = int(ppid)
-                                except: continue
-                                if ppid in pidlist and pid not in pids:
-                                    pids += [ pid ]
-                    except IOError as e:
-                        logg.warning("%s : %s", proc_status, e)
-                        continue
-            if len(pids) != len(pidlist):
-                pidlist = pids[:]
-                continue
+            nextlevel = []
+            for parent in level:
+                for child in children.get(parent, []):
+                    if child not in seen:
+                        seen.add(child)
+                        nextlevel.append(child)
+            if not nextlevel:
+                break
+            pids += nextlevel
+            level = nextlevel
         return pids
     def etc_hosts(self):
         path = "/etc/hosts"
@@ -4407,9 +6076,9 @@ if __name__ == "__main__":
     _o.add_option("-l","--full", action="store_true", default=_full,
         help="Don't ellipsize unit names on output (never ellipsized)")
     _o.add_option("--reverse", action="store_true",
-        help="Show reverse dependencies with 'list-dependencies' (ignored)")
-    _o.add_option("--job-mode", metavar="MODE",
-        help="Specifiy how to deal with already queued jobs, when queuing a new job (ignored)")    
+        help="Show reverse dependencies with 'list-dependencies'")
+    _o.add_option("--job-mode", metavar="MODE", default=_job_mode,
+        help="Specifiy how to deal with already queued jobs, when queuing a new job (fail, replace or ignore-dependencies) [%default]")    
     _o.add_option("--show-types", action="store_true",
         help="When showing sockets, explicitly show their type (ignored)")
     _o.add_option("-i","--ignore-inhibitors", action="store_true",
@@ -4445,7 +6114,7 @@ if __name__ == "__main__":
     _o.add_option("-n","--lines", metavar="NUM",
         help="Number of journal entries to show (ignored)")
     _o.add_option("-o","--output", metavar="CAT",
-        help="change journal output mode [short, ..., cat] (ignored)")
+        help="change journal output mode [short, ..., cat] (ignored) or 'json' for a daemon-reload summary")
     _o.add_option("--plain", action="store_true",
         help="Print unit dependencies as a list instead of a tree (ignored)")
     _o.add_option("--no-pager", action="store_true",
@@ -4463,11 +6132,17 @@ if __name__ == "__main__":
         help="..only keep ipv6 localhost in /etc/hosts")
     _o.add_option("-1","--init", action="store_true", default=False,
         help="..keep running as init-process (default if PID 1)")
+    _o.add_option("--load-threads", metavar="NUM", type="int", default=LoadUnitThreads,
+        help="..number of threads for loading many unit files [%default]")
+    _o.add_option("--jobs", metavar="NUM", type="int", default=UnitJobs,
+        help="..number of units being started/stopped at the same time [%default]")
     opt, args = _o.parse_args()
     logging.basicConfig(level = max(0, logging.FATAL - 10 * opt.verbose))
     logg.setLevel(max(0, logging.ERROR - 10 * opt.verbose))
     #
     COVERAGE = opt.coverage
+    LoadUnitThreads = opt.load_threads
+    UnitJobs = opt.jobs
     if "sleep" in COVERAGE:
          MinimumTimeoutStartSec = 7
          MinimumTimeoutStopSec = 7
@@ -4486,6 +6161,9 @@ if __name__ == "__main__":
     _quiet = opt.quiet
     _root = opt.root
     _show_all = opt.show_all
+    _reverse = opt.reverse
+    _output = opt.output
+    _job_mode = opt.job_mode
     _unit_state = opt.state
     _unit_type = opt.unit_type
     _unit_property = opt.unit_property
@@ -4569,4 +6247,6 @@ if __name__ == "__main__":
         logg.error("Unknown operation %s.", command)
         sys.exit(1)
     #
-    sys.exit(print_result(result))
+    exitcode = print_result(result)
+    systemctl.save_unit_cache()
+    sys.exit(exitcode)
@@ -20,6 +20,7 @@ import inspect
 import types
 import logging
 import re
+import signal
 from fnmatch import fnmatchcase as fnmatch
 from glob import glob
 import json
@@ -437,6 +438,886 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.assertEqual(end, 0)
         self.assertFalse(greps(out, "--verbose"))
         self.assertTrue(greps(out, "reload-or-try-restart"))
+    def test_1001_start_order_ranks(self):
+        """ units are started in their After= order - one after another
+            with --jobs=1 and independent units in parallel otherwise """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        for name, after, sleep in [ ("zza", "", 1011), ("zzb", "zza.service", 1012),
+                                    ("zzc", "zzb.service", 1013), ("zzd", "", 1014) ]:
+            text_file(os_path(root, "/etc/systemd/system/%s.service" % name),"""
+                [Unit]
+                Description=Testing {name}
+                After={after}
+                [Service]
+                Type=simple
+                ExecStartPre=/bin/sh -c 'echo {name}.begin >> {root}/order.txt; sleep 2; echo {name}.end >> {root}/order.txt'
+                ExecStart=/bin/sleep {sleep}
+                """.format(**locals()))
+        order_txt = os_path(root, "/order.txt")
+        for jobs in [ 1, 4 ]:
+            cmd = "{systemctl} start zzd.service zzc.service zzb.service zza.service --jobs={jobs}"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertEqual(end, 0)
+            order = lines(open(order_txt).read())
+            logg.info("--jobs=%s order %s", jobs, order)
+            self.assertEqual(len(order), 8)
+            self.assertLess(order.index("zza.end"), order.index("zzb.begin"))
+            self.assertLess(order.index("zzb.end"), order.index("zzc.begin"))
+            if jobs == 1:
+                # no start overlaps with another one
+                for index in xrange(0, 8, 2):
+                    self.assertEqual(order[index].split(".")[0], order[index+1].split(".")[0])
+            else:
+                # zzd has no After= so it runs along with zza
+                self.assertLess(order.index("zzd.begin"), order.index("zza.end"))
+                self.assertLess(order.index("zza.begin"), order.index("zzd.end"))
+            cmd = "{systemctl} stop zza.service zzb.service zzc.service zzd.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+            os.remove(order_txt)
+        self.rm_testdir()
+    def test_1002_start_failure_propagation(self):
+        """ a failing unit makes the start fail without blocking the other
+            units, and a unit is not started when its Requisite= is down """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/false
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            After=zza.service
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1021
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            Requisite=zzb.service
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1022
+            """)
+        for jobs in [ 1, 4 ]:
+            cmd = "{systemctl} start zza.service zzb.service --jobs={jobs}"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertNotEqual(end, 0)
+            cmd = "{systemctl} show -p ActiveState zza.service zzb.service"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertEqual(lines(out), [ "ActiveState=failed", "", "ActiveState=active" ])
+            cmd = "{systemctl} stop zzb.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+            cmd = "{systemctl} reset-failed zza.service"
+            out, end = output2(cmd.format(**locals()))
+        #
+        cmd = "{systemctl} start zzc.service"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, out, err)
+        self.assertNotEqual(end, 0)
+        self.assertTrue(greps(err, "Requisite=zzb.service which is not active"))
+        cmd = "{systemctl} show -p ActiveState zzb.service zzc.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), [ "ActiveState=inactive", "", "ActiveState=inactive" ])
+        cmd = "{systemctl} start zzb.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        cmd = "{systemctl} start zzc.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        cmd = "{systemctl} stop zzc.service zzb.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.rm_testdir()
+    def test_1003_start_pulls_in_requires_and_wants(self):
+        """ a start does also start the Requires= and Wants= units but
+            not with --job-mode=ignore-dependencies """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            Requires=zzb.service
+            Wants=zzc.service
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1031
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1032
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1033
+            """)
+        cmd = "{systemctl} start zza.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        cmd = "{systemctl} show -p ActiveState zza.service zzb.service zzc.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=active" ] * 3)
+        cmd = "{systemctl} stop zza.service zzb.service zzc.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        #
+        cmd = "{systemctl} start zza.service --job-mode=ignore-dependencies"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        cmd = "{systemctl} show -p ActiveState zza.service zzb.service zzc.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=active", "ActiveState=inactive", "ActiveState=inactive" ])
+        cmd = "{systemctl} stop zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.rm_testdir()
+    def test_1008_start_failed_requires_and_wants(self):
+        """ a failed Requires= unit (being After= as well) does not let
+            the dependent start, a failed Wants= unit is not an error """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/false
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            Requires=zza.service
+            After=zza.service
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1081
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            Requires=zzb.service
+            After=zzb.service
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1082
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzd.service"),"""
+            [Unit]
+            Description=Testing D
+            Wants=zza.service
+            After=zza.service
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1083
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zze.service"),"""
+            [Unit]
+            Description=Testing E
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1084
+            """)
+        os.makedirs(os_path(root, "/etc/systemd/system/zze.service.wants"))
+        os.symlink("../zza.service", os_path(root, "/etc/systemd/system/zze.service.wants/zza.service"))
+        for jobs in [ 1, 4 ]:
+            cmd = "{systemctl} start zzc.service --jobs={jobs}"
+            out, err, end = output3(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, err)
+            self.assertNotEqual(end, 0)
+            self.assertTrue(greps(err, "Dependency failed for zzb.service"))
+            self.assertTrue(greps(err, "Dependency failed for zzc.service"))
+            cmd = "{systemctl} show -p ActiveState zza.service zzb.service zzc.service"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=failed", "ActiveState=inactive", "ActiveState=inactive" ])
+            cmd = "{systemctl} reset-failed zza.service"
+            out, end = output2(cmd.format(**locals()))
+            cmd = "{systemctl} start zzd.service zze.service --jobs={jobs}"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertEqual(end, 0)
+            cmd = "{systemctl} show -p ActiveState zza.service zzd.service zze.service"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=failed", "ActiveState=active", "ActiveState=active" ])
+            cmd = "{systemctl} stop zzd.service zze.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+            cmd = "{systemctl} reset-failed zza.service"
+            out, end = output2(cmd.format(**locals()))
+        self.rm_testdir()
+    def test_1004_stop_propagates_to_partof(self):
+        """ a stop does also stop the PartOf= dependents - and they are
+            stopped before the unit they are part of """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1041
+            ExecStop=/bin/sh -c 'sleep 1; echo zza >> {root}/order.txt; kill $MAINPID'
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            PartOf=zza.service
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1042
+            ExecStop=/bin/sh -c 'sleep 1; echo zzb >> {root}/order.txt; kill $MAINPID'
+            """.format(**locals()))
+        cmd = "{systemctl} list-dependencies --reverse zza.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(out, "zzb.service"))
+        order_txt = os_path(root, "/order.txt")
+        for jobs in [ 1, 4 ]:
+            cmd = "{systemctl} start zza.service zzb.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+            cmd = "{systemctl} stop zza.service --jobs={jobs}"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertEqual(end, 0)
+            cmd = "{systemctl} show -p ActiveState zza.service zzb.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=inactive" ] * 2)
+            order = lines(open(order_txt).read())
+            logg.info("--jobs=%s order %s", jobs, order)
+            self.assertEqual(order, [ "zzb", "zza" ])
+            os.remove(order_txt)
+        self.rm_testdir()
+    def test_1005_job_merge_and_cancel(self):
+        """ a second restart attaches to the running restart job, a stop
+            with --job-mode=fail is refused, a start replaces a pending stop
+            and the job of a killed systemctl is not waited for """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStartPre=/bin/sh -c 'sleep 2; echo zza >> {root}/started.txt'
+            ExecStart=/bin/sleep 1051
+            """.format(**locals()))
+        started_txt = os_path(root, "/started.txt")
+        cmd = "{systemctl} start zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        os.remove(started_txt)
+        #
+        cmd = "{systemctl} restart zza.service"
+        first = subprocess.Popen(cmd.format(**locals()), shell=True)
+        time.sleep(0.5)
+        cmd = "{systemctl} restart zza.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, err)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(err, "attached to restart job"))
+        self.assertEqual(first.wait(), 0)
+        self.assertEqual(len(lines(open(started_txt).read())), 1)
+        #
+        cmd = "{systemctl} restart zza.service"
+        first = subprocess.Popen(cmd.format(**locals()), shell=True)
+        time.sleep(0.5)
+        cmd = "{systemctl} stop zza.service --job-mode=fail"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, err)
+        self.assertNotEqual(end, 0)
+        self.assertTrue(greps(err, "is destructive"))
+        self.assertEqual(first.wait(), 0)
+        #
+        cmd = "{systemctl} restart zza.service"
+        first = subprocess.Popen(cmd.format(**locals()), shell=True)
+        time.sleep(0.5)
+        cmd = "{systemctl} stop zza.service"
+        second = subprocess.Popen(cmd.format(**locals()), shell=True)
+        time.sleep(0.5)
+        cmd = "{systemctl} start zza.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, err)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(err, "replaces stop job"))
+        self.assertNotEqual(second.wait(), 0)
+        self.assertEqual(first.wait(), 0)
+        cmd = "{systemctl} show -p ActiveState zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), [ "ActiveState=active" ])
+        #
+        cmd = _python + " " + _systemctl_py + " --root=" + root + " restart zza.service"
+        first = subprocess.Popen(cmd.split())
+        time.sleep(0.5)
+        first.kill()
+        first.wait()
+        started = time.time()
+        cmd = "{systemctl} restart zza.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, err)
+        self.assertEqual(end, 0)
+        self.assertFalse(greps(err, "attached to restart job"))
+        self.assertLess(time.time() - started, 10)
+        cmd = "{systemctl} stop zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.rm_testdir()
+    def test_1006_changed_unit_file_is_seen(self):
+        """ the parsed units are cached - a changed unit file is seen by
+            the next command without a daemon-reload """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing First
+            [Service]
+            ExecStart=/bin/sleep 1061
+            """)
+        cmd = "{systemctl} show -p Description zza.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(lines(out), [ "Description=Testing First" ])
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing Second
+            [Service]
+            ExecStart=/bin/sleep 1061
+            """)
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(lines(out), [ "Description=Testing Second" ])
+        # and when the change is not racy (an older mtime)
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing Third
+            [Service]
+            ExecStart=/bin/sleep 1061
+            """)
+        past = time.time() - 100
+        os.utime(os_path(root, "/etc/systemd/system/zza.service"), (past, past))
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(lines(out), [ "Description=Testing Third" ])
+        self.rm_testdir()
+    def test_1009_new_and_removed_unit_files_are_seen(self):
+        """ the unit file index is kept across commands - a new or a
+            removed unit file is seen by the next command """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            ExecStart=/bin/sleep 1091
+            """)
+        # the index is only written for folders with an older mtime
+        past = time.time() - 100
+        os.utime(os_path(root, "/etc/systemd/system"), (past, past))
+        cmd = "{systemctl} list-unit-files"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertTrue(greps(out, "^zza.service"))
+        self.assertFalse(greps(out, "^zzb.service"))
+        self.assertTrue(os.path.exists(os_path(root, "/var/run/systemd/systemctl.units.index")))
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            ExecStart=/bin/sleep 1092
+            """)
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertTrue(greps(out, "^zza.service"))
+        self.assertTrue(greps(out, "^zzb.service"))
+        os.remove(os_path(root, "/etc/systemd/system/zza.service"))
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertFalse(greps(out, "^zza.service"))
+        self.assertTrue(greps(out, "^zzb.service"))
+        cmd = "{systemctl} show -p Description zzb.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), [ "Description=Testing B" ])
+        self.rm_testdir()
+    def test_1007_init_loop_exits_after_halt(self):
+        """ the init-loop on PID-1 does exit after 'systemctl halt' has
+            stopped its services (in a separate pid namespace) """
+        if os.getuid() != 0 or not os.path.exists("/usr/bin/unshare"):
+            self.skipTest("needs root for unshare/nsenter")
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + os.path.abspath(_systemctl_py) + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1071
+            [Install]
+            WantedBy=multi-user.target
+            """)
+        cmd = "{systemctl} enable zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        cmd = "unshare --pid --fork --mount-proc {systemctl} init zza.service"
+        env = dict(os.environ, SYSTEMCTL_INITLOOP = "2")
+        init = subprocess.Popen(cmd.format(**locals()).split(), env = env)
+        time.sleep(3)
+        pid = int(output("pgrep -P %s" % init.pid).split()[0])
+        cmd = "nsenter --target {pid} --pid --mount {systemctl} halt"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        for attempt in xrange(20):
+            if init.poll() is not None:
+                break
+            time.sleep(1)
+        if init.poll() is None:
+            os.kill(pid, signal.SIGKILL)
+            init.wait()
+            self.fail("init-loop did not exit after halt")
+        logg.info("init-loop exit %s after %ss", init.returncode, attempt)
+        self.assertLess(attempt, 10)
+        self.rm_testdir()
+    def test_1010_shutdown_deadline_kills_the_rest(self):
+        """ a service that does not stop on SIGTERM is killed when the
+            TimeoutShutdownSec after the SIGTERM to the init-loop is over """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStart=/bin/sh -c 'trap "" TERM; exec /bin/sleep 1101'
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1102
+            """)
+        cmd = "{systemctl} init zza.service zzb.service"
+        env = dict(os.environ, SYSTEMCTL_TIMEOUT_SHUTDOWN_SEC = "3")
+        init = subprocess.Popen(cmd.format(**locals()).split(), env = env)
+        time.sleep(3)
+        cmd = "{systemctl} show -p ActiveState zza.service zzb.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=active" ] * 2)
+        started = time.time()
+        os.kill(init.pid, signal.SIGTERM)
+        for attempt in xrange(20):
+            if init.poll() is not None:
+                break
+            time.sleep(0.5)
+        if init.poll() is None:
+            init.kill()
+            init.wait()
+        elapsed = time.time() - started
+        logg.info("init-loop exit %s after %.2fs", init.returncode, elapsed)
+        top = output("ps -eo args")
+        self.assertFalse(greps(top, "^/bin/sleep 110[12]"))
+        self.assertGreater(elapsed, 2)
+        self.assertLess(elapsed, 4.5)
+        self.rm_testdir()
+    def test_1011_init_loop_picks_up_unit_file_changes(self):
+        """ the init-loop reloads a changed unit file (so its new ExecStop
+            is run at the end) and a daemon-reload does not kill the init
+            process - neither in the loop nor while it starts the units """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStartPre=/bin/sleep 2
+            ExecStart=/bin/sleep 1111
+            """)
+        cmd = "{systemctl} init zza.service"
+        init = subprocess.Popen(cmd.format(**locals()).split())
+        time.sleep(1)
+        init_pid = os_path(root, "/var/run/systemd/systemctl.init.pid")
+        self.assertTrue(os.path.exists(init_pid))
+        cmd = "{systemctl} daemon-reload"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        time.sleep(3)
+        self.assertEqual(init.poll(), None)
+        cmd = "{systemctl} show -p ActiveState zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), [ "ActiveState=active" ])
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStartPre=/bin/sleep 2
+            ExecStart=/bin/sleep 1111
+            ExecStop=/bin/sh -c 'echo stopped >> {root}/stopped.txt; kill $MAINPID'
+            """.format(**locals()))
+        time.sleep(1)
+        cmd = "{systemctl} daemon-reload"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        time.sleep(1)
+        self.assertEqual(init.poll(), None)
+        init.send_signal(signal.SIGTERM)
+        for attempt in xrange(20):
+            if init.poll() is not None:
+                break
+            time.sleep(0.5)
+        if init.poll() is None:
+            init.kill()
+            init.wait()
+        top = output("ps -eo args")
+        self.assertFalse(greps(top, "^/bin/sleep 1111"))
+        self.assertEqual(lines(open(os_path(root, "/stopped.txt")).read()), [ "stopped" ])
+        self.assertFalse(os.path.exists(init_pid))
+        self.rm_testdir()
+    def test_1012_init_loop_records_main_exit_code(self):
+        """ the init-loop reaps an exited main process and records its
+            ExecMainCode - also for a main process killed by a signal """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStart=/bin/sh -c 'sleep 1; kill -SEGV $$'
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart=/bin/sh -c 'sleep 1; exit 3'
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1121
+            """)
+        cmd = "{systemctl} init zza.service zzb.service zzc.service --jobs=1"
+        init = subprocess.Popen(cmd.format(**locals()).split())
+        time.sleep(4)
+        status = {}
+        for unit in [ "zza", "zzb" ]:
+            status[unit] = open(os_path(root, "/var/run/%s.service.status" % unit)).read()
+            logg.info("%s.service.status\n%s", unit, status[unit])
+        running = init.poll() is None
+        init.send_signal(signal.SIGTERM)
+        for attempt in xrange(20):
+            if init.poll() is not None:
+                break
+            time.sleep(0.5)
+        if init.poll() is None:
+            init.kill()
+            init.wait()
+        top = output("ps -eo args")
+        self.assertFalse(greps(top, "^/bin/sleep 1121"))
+        self.assertTrue(running)
+        self.assertTrue(greps(status["zza"], "^ExecMainCode=%s$" % (128 + signal.SIGSEGV)))
+        self.assertTrue(greps(status["zzb"], "^ExecMainCode=3$"))
+        self.rm_testdir()
+    def test_1013_stop_and_kill_with_and_without_pidfd(self):
+        """ stop and kill work with a pidfd and by plain pids as well (as on
+            python2 and python3 < 3.9 which have no os.pidfd_open) """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStart=/bin/sh -c 'trap "" TERM; exec /bin/sleep 1131'
+            TimeoutStopSec=2
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1132
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart=/bin/sleep 1133
+            ExecStop=/bin/kill $MAINPID
+            """)
+        cmd = _python + " -c 'import os, signal; print(hasattr(os, \"pidfd_open\") and hasattr(signal, \"pidfd_send_signal\"))'"
+        has_pidfd = output(cmd).strip() == "True"
+        for no_pidfd in [ "", "1" ]:
+            env = "SYSTEMCTL_NO_PIDFD=" + no_pidfd
+            cmd = "{systemctl} start zza.service zzb.service zzc.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+            time.sleep(1)
+            self.assertEqual(len(greps(output("ps -eo args"), "^/bin/sleep 113[123]")), 3)
+            cmd = "{env} {systemctl} stop zza.service -vvv"
+            out, err, end = output3(cmd.format(**locals()))
+            logg.info("stop zza => %s\n%s", end, err)
+            pidfd_used = greps(err, ":pidfd for PIDs")
+            plain_used = greps(err, "no pidfd for PIDs")
+            cmd = "{env} {systemctl} kill zzb.service -vvv"
+            out, err, end = output3(cmd.format(**locals()))
+            logg.info("kill zzb => %s\n%s", end, err)
+            pidfd_used += greps(err, ":pidfd for PIDs")
+            plain_used += greps(err, "no pidfd for PIDs")
+            cmd = "{env} {systemctl} stop zzc.service -vvv"
+            out, err, end = output3(cmd.format(**locals()))
+            logg.info("stop zzc => %s\n%s", end, err)
+            pidfd_used += greps(err, ":pidfd for PIDs")
+            plain_used += greps(err, "no pidfd for PIDs")
+            time.sleep(1)
+            self.assertFalse(greps(output("ps -eo args"), "^/bin/sleep 113[123]"))
+            if has_pidfd and not no_pidfd:
+                self.assertEqual(len(pidfd_used), 3)
+                self.assertFalse(plain_used)
+            else:
+                self.assertFalse(pidfd_used)
+                self.assertEqual(len(plain_used), 3)
+            cmd = "{systemctl} show -p ActiveState zza.service zzb.service zzc.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=inactive" ] * 3)
+        self.rm_testdir()
+    def test_1014_daemon_reload_summary_and_check_cache(self):
+        """ daemon-reload -o json reports the problems of the units, an
+            unchanged unit is not checked again but a changed unit is
+            (and so is a unit whose EnvironmentFile did show up) """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            EnvironmentFile=/etc/zza.env
+            ExecStart=/bin/sleep 1141
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            ExecStart=sleep 1142
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            ExecStart=/bin/sleep 1143
+            """)
+        # the check is only cached for files with an older mtime
+        def backdate(*paths):
+            past = time.time() - 100
+            for path in paths:
+                os.utime(os_path(root, path), (past, past))
+        backdate("/etc/systemd/system/zza.service", "/etc/systemd/system/zzb.service",
+                 "/etc/systemd/system/zzc.service", "/etc/systemd/system")
+        cmd = "{systemctl} daemon-reload -o json"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        result = json.loads(out)
+        self.assertEqual(result["units"], 3)
+        self.assertEqual(result["checked"], 3)
+        self.assertGreater(result["errors"], 100)
+        problems = dict([ (item["unit"], item) for item in result["problems"] ])
+        self.assertEqual(sorted(problems), [ "zza.service", "zzb.service" ])
+        self.assertTrue(greps(problems["zza.service"]["messages"][0]["message"], "Failed to load environment files"))
+        self.assertTrue(greps(problems["zzb.service"]["messages"][0]["message"], "Executable path is not absolute"))
+        self.assertEqual(problems["zzb.service"]["messages"][0]["level"], "ERROR")
+        # unchanged => the same problems from the cache
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        cached = json.loads(out)
+        self.assertEqual(cached["checked"], 0)
+        self.assertEqual(cached["errors"], result["errors"])
+        self.assertEqual(cached["problems"], result["problems"])
+        # a fixed unit file and a new environment file => checked again
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            ExecStart=/bin/sleep 1142
+            """)
+        backdate("/etc/systemd/system/zzb.service")
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        result = json.loads(out)
+        self.assertEqual(result["checked"], 1)
+        self.assertEqual([ item["unit"] for item in result["problems"] ], [ "zza.service" ])
+        text_file(os_path(root, "/etc/zza.env"), "X=1\n")
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        result = json.loads(out)
+        self.assertEqual(result["checked"], 1)
+        self.assertEqual(result["errors"], 0)
+        self.assertEqual(result["problems"], [])
+        out, end = output2(cmd.format(**locals()))
+        result = json.loads(out)
+        self.assertEqual(result["checked"], 0)
+        self.assertEqual(result["problems"], [])
+        # a unit file changed within the same second is never cached
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            ExecStart=/bin/sleep 1143
+            ExecRestart=/bin/true
+            """)
+        for attempt in xrange(2):
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            result = json.loads(out)
+            self.assertEqual(result["checked"], 1)
+            self.assertEqual([ item["unit"] for item in result["problems"] ], [ "zzc.service" ])
+        self.rm_testdir()
+    def test_1015_after_cycle_is_reported_and_units_start(self):
+        """ an ordering cycle in After= is reported, the units in the cycle
+            and the units before and after it are still started - in the
+            same order on each run """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        order = os.path.abspath(os_path(testdir, "order.txt"))
+        units = [ ("zza", "zzb.service zzd.service"), ("zzb", "zzc.service"),
+                  ("zzc", "zza.service"), ("zzd", ""), ("zze", "zzc.service") ]
+        for num, (name, after) in enumerate(units):
+            text_file(os_path(root, "/etc/systemd/system/%s.service" % name),"""
+                [Unit]
+                Description=Testing {name}
+                After={after}
+                [Service]
+                Type=simple
+                ExecStartPre=/bin/sh -c 'echo {name} >> {order}'
+                ExecStart=/bin/sleep 115{num}
+                """.format(**locals()))
+        orders = []
+        for jobs in [ "--jobs=1", "--jobs=1", "" ]:
+            if os.path.exists(order):
+                os.remove(order)
+            cmd = "{systemctl} start zze.service zzc.service zzb.service zza.service zzd.service {jobs} -v"
+            out, err, end = output3(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s\n%s", cmd, end, err, out)
+            self.assertEqual(end, 0)
+            self.assertTrue(greps(err, "found ordering cycle on zz[abc].service, zz[abc].service, zz[abc].service"))
+            cmd = "{systemctl} show -p ActiveState zza.service zzb.service zzc.service zzd.service zze.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(greps(out, "ActiveState"), [ "ActiveState=active" ] * 5)
+            orders.append(lines(open(order).read()))
+            cmd = "{systemctl} stop zza.service zzb.service zzc.service zzd.service zze.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+        logg.info("orders %s", orders)
+        self.assertEqual(orders[0], orders[1])
+        self.assertEqual(orders[0][0], "zzd")
+        self.assertEqual(sorted(orders[0][1:4]), [ "zza", "zzb", "zzc" ])
+        self.assertEqual(orders[0][4], "zze")
+        self.assertEqual(sorted(orders[2]), [ "zza", "zzb", "zzc", "zzd", "zze" ])
+        self.assertGreater(orders[2].index("zza"), orders[2].index("zzd"))
+        self.assertGreater(orders[2].index("zze"), orders[2].index("zzc"))
+        self.assertFalse(greps(output("ps -eo args"), "^/bin/sleep 115"))
+        self.rm_testdir()
+    def test_1016_enable_and_disable_outdate_the_unit_index(self):
+        """ the unit index keeps the .wants folder entries - an enable or
+            disable is seen by the next command (is-enabled and the services
+            of the default target) even when the index had been written """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = _python + " " + _systemctl_py + " --root=" + root
+        for name, num in [ ("zza", 1161), ("zzb", 1162) ]:
+            text_file(os_path(root, "/etc/systemd/system/%s.service" % name),"""
+                [Unit]
+                Description=Testing {name}
+                [Service]
+                Type=simple
+                ExecStart=/bin/sleep {num}
+                [Install]
+                WantedBy=multi-user.target
+                """.format(**locals()))
+        index = os_path(root, "/var/run/systemd/systemctl.units.index")
+        # the index is only written for folders with an older mtime
+        def backdate():
+            past = time.time() - 100
+            for folder in [ "/etc/systemd/system", "/etc/systemd/system/multi-user.target.wants" ]:
+                if os.path.isdir(os_path(root, folder)):
+                    os.utime(os_path(root, folder), (past, past))
+        def is_enabled():
+            cmd = "{systemctl} is-enabled zza.service zzb.service"
+            out, end = output2(cmd.format(systemctl = systemctl))
+            return lines(out)
+        def default_services():
+            cmd = "{systemctl} default"
+            out, end = output2(cmd.format(systemctl = systemctl))
+            cmd = "{systemctl} show -p ActiveState zza.service zzb.service"
+            out, end = output2(cmd.format(systemctl = systemctl))
+            cmd = "{systemctl} stop zza.service zzb.service"
+            output2(cmd.format(systemctl = systemctl))
+            return greps(out, "ActiveState")
+        backdate()
+        self.assertEqual(is_enabled(), [ "disabled", "disabled" ])
+        self.assertTrue(os.path.exists(index))
+        cmd = "{systemctl} enable zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertEqual(is_enabled(), [ "enabled", "disabled" ])
+        self.assertEqual(default_services(), [ "ActiveState=active", "ActiveState=inactive" ])
+        # enable into an existing .wants folder
+        backdate()
+        self.assertEqual(is_enabled(), [ "enabled", "disabled" ])
+        cmd = "{systemctl} enable zzb.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertEqual(is_enabled(), [ "enabled", "enabled" ])
+        self.assertEqual(default_services(), [ "ActiveState=active", "ActiveState=active" ])
+        backdate()
+        self.assertEqual(is_enabled(), [ "enabled", "enabled" ])
+        cmd = "{systemctl} disable zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertEqual(is_enabled(), [ "disabled", "enabled" ])
+        self.assertEqual(default_services(), [ "ActiveState=inactive", "ActiveState=active" ])
+        self.assertFalse(greps(output("ps -eo args"), "^/bin/sleep 116[12]"))
+        self.rm_testdir()
     def test_701_centos_httpd_dockerfile(self):
         """ WHEN using a dockerfile for systemd-enabled CentOS 7, 
             THEN we can create an image with an Apache HTTP service 